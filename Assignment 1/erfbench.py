@@ -0,0 +1,323 @@
+"""
+Author: Alexander Hickey
+
+This script benchmarks the functions in erftools.py against
+scipy.special. For every function, region of the complex plane and array
+size it records the throughput (points per second) and the maximum and
+median relative error, and writes the results as JSON so that speed and
+accuracy can be compared between versions, e.g.
+
+    python erfbench.py --out new.json --baseline old.json
+
+A testing framework is built in, and can be run by loading this file into
+the __main__ namespace.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import scipy
+import scipy.special as special
+import erftools
+
+
+#Default array sizes to benchmark
+SIZES = (1000, 100000)
+
+#Scalar functions loop in python, so they are capped at this many points
+SCALAR_MAX = 10000
+
+
+def region_points(region, size, rng):
+    '''
+    Sample arguments z of the Faddeeva function in one of the regions the
+    Gautschi algorithm distinguishes. The error functions are evaluated at
+    -iz, so that they call w at the same points.
+
+    Args:
+        region: Name of the region, see REGIONS
+        size: Number of points
+        rng: numpy random Generator
+
+    Return:
+        z: Array of complex numbers
+    '''
+
+    u, v = rng.random(size), rng.random(size)
+
+    if region == 'inner':
+        #Inner region of the first quadrant, y < 4.29 and x < 5.33
+        return 5.33*u + 4.29j*v
+
+    elif region == 'outer':
+        #Outer region of the first quadrant, up to |z| = 10
+        z = 10*u + 10j*v
+        inner = np.logical_and(z.real < 5.33, z.imag < 4.29)
+        z[inner] += 5.33
+        return z
+
+    elif region in ('Q2', 'Q3', 'Q4'):
+        #Other quadrants, kept to |Re z|, |Im z| < 5 to avoid overflow
+        sx, sy = {'Q2': (-1,1), 'Q3': (-1,-1), 'Q4': (1,-1)}[region]
+        return 5*sx*u + 5j*sy*v
+
+    elif region == 'real_axis':
+        return 20*u - 10 + 0j
+
+    elif region == 'imag_axis':
+        return 1.0j*(10*v - 5)
+
+    elif region == 'unit_disk':
+        #Region of convergence used for erf_taylor, in terms of -iz
+        return 1.0j*np.sqrt(u)*np.exp(2.0j*np.pi*v)
+
+    elif region == 'near_zeros':
+        #Within 1e-3 of the first 50 zeros of erf, in terms of -iz
+        zeros = special.erf_zeros(50)
+        near = zeros[rng.integers(0, 50, size)]
+        near = near + 1e-3*np.sqrt(u)*np.exp(2.0j*np.pi*v)
+        return 1.0j*near
+
+    raise ValueError('Unknown region {}'.format(region))
+
+
+#Regions of the complex plane to benchmark
+REGIONS = ('inner', 'outer', 'Q2', 'Q3', 'Q4', 'real_axis', 'imag_axis',
+           'unit_disk', 'near_zeros')
+
+
+#Functions to benchmark, as (function of z, reference, is_scalar, regions)
+#where z is the argument of w, and the error functions are called at -iz.
+#The _real variants pass real arrays, to time the real axis path
+FUNCTIONS = {
+    'w_vec': (lambda z: erftools.w_vec(z), special.wofz, False, REGIONS),
+    'erf_vec': (lambda z: erftools.erf_vec(-1.0j*z),
+                lambda z: special.erf(-1.0j*z), False, REGIONS),
+    'w_vec_c64': (lambda z: erftools.w_vec(z, dtype=np.complex64),
+                  special.wofz, False, REGIONS),
+    'w_vec_real': (lambda z: erftools.w_vec(z.real),
+                   lambda z: special.wofz(z.real), False, ('real_axis',)),
+    'erf_vec_real': (lambda z: erftools.erf_vec(z.imag),
+                     lambda z: special.erf(z.imag), False, ('imag_axis',)),
+    'erf': (lambda z: np.array([erftools.erf(v) for v in -1.0j*z]),
+            lambda z: special.erf(-1.0j*z), True, REGIONS),
+    'erf_taylor': (lambda z: erftools.erf_taylor(-1.0j*z),
+                   lambda z: special.erf(-1.0j*z), False, ('unit_disk',)),
+    }
+
+
+def bench_one(func, ref, z, repeat=3):
+    '''
+    Time a function on an array of points and compare it to a reference.
+
+    Args:
+        func: Function to benchmark
+        ref: Reference implementation
+        z: Array of complex numbers
+        repeat: Number of timings, the fastest is kept
+
+    Return:
+        result: Dictionary with throughput and relative errors
+    '''
+
+    #Fastest of a few runs
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        val = func(z)
+        best = min(best, time.perf_counter() - start)
+
+    #Relative error, measured in absolute terms where the reference is zero
+    exact = ref(z)
+    err = np.abs(val-exact)/np.maximum(np.abs(exact), np.finfo(float).tiny)
+
+    return {'points_per_s': z.size/best,
+            'max_rel_err': float(np.max(err)),
+            'median_rel_err': float(np.median(err))}
+
+
+def run(sizes=SIZES, functions=None, backend=None, seed=0, repeat=3):
+    '''
+    Run the benchmark suite.
+
+    Args:
+        sizes: Array sizes to benchmark
+        functions: Names of functions to benchmark, defaults to all
+        backend: erftools backend to use, defaults to get_backend()
+        seed: Seed for the random points
+        repeat: Number of timings per case
+
+    Return:
+        report: Dictionary with metadata and a list of results
+    '''
+
+    #The backend is switched for the run only, and restored afterwards
+    previous = erftools.get_backend()
+    if backend is not None:
+        erftools.set_backend(backend)
+
+    try:
+        rng = np.random.default_rng(seed)
+        results = []
+
+        for name in functions or FUNCTIONS:
+
+            func, ref, scalar, regions = FUNCTIONS[name]
+
+            for region in regions:
+                for size in sizes:
+
+                    if scalar:
+                        size = min(size, SCALAR_MAX)
+
+                    z = region_points(region, size, rng)
+                    res = bench_one(func, ref, z, repeat=repeat)
+                    res.update({'function': name, 'region': region,
+                                'size': size})
+                    results.append(res)
+
+        meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'numpy': np.__version__, 'scipy': scipy.__version__,
+                'backend': erftools.get_backend(), 'seed': seed}
+
+    finally:
+        erftools.set_backend(previous)
+
+    return {'meta': meta, 'results': results}
+
+
+def compare(old, new, speed_tol=0.8, err_tol=10.0):
+    '''
+    Find regressions between two benchmark reports.
+
+    Args:
+        old: Baseline report
+        new: New report
+        speed_tol: Flag cases whose throughput falls below this fraction of
+                   the baseline
+        err_tol: Flag cases whose maximum error grows by more than this
+                 factor (and above 1e-15)
+
+    Return:
+        regressions: List of (function, region, size, message)
+    '''
+
+    key = lambda r: (r['function'], r['region'], r['size'])
+    base = {key(r): r for r in old['results']}
+    regressions = []
+
+    for r in new['results']:
+
+        b = base.get(key(r))
+        if b is None:
+            continue
+
+        if r['points_per_s'] < speed_tol*b['points_per_s']:
+            regressions.append(key(r) + ('throughput {:.3g} -> {:.3g} pts/s'
+                               .format(b['points_per_s'], r['points_per_s']),))
+
+        if r['max_rel_err'] > max(err_tol*b['max_rel_err'], 1e-15):
+            regressions.append(key(r) + ('max error {:.3g} -> {:.3g}'
+                               .format(b['max_rel_err'], r['max_rel_err']),))
+
+    return regressions
+
+
+def main(argv=None):
+    '''
+    Command line interface, run with --help for options.
+    '''
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--out', default='erfbench.json',
+                        help='JSON file to write the results to')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--functions', nargs='+', choices=list(FUNCTIONS))
+    parser.add_argument('--backend', choices=erftools.BACKENDS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', help='Earlier JSON file to compare to')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.functions, args.backend,
+                 repeat=args.repeat)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    for r in report['results']:
+        print('{function:>10} {region:>10} {size:>8} {points_per_s:10.3g} '
+              'pts/s  max {max_rel_err:.2e}  median {median_rel_err:.2e}'
+              .format(**r))
+
+    if args.baseline:
+
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report)
+
+        for reg in regressions:
+            print('REGRESSION', *reg)
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+###############################################################################
+#Testing framework
+
+import unittest
+
+class TestErfBench(unittest.TestCase):
+    '''
+    Unit testing class for functions in the erfbench.py script
+    '''
+
+    def test_Run(self):
+        '''
+        Test that a small run covers every function and region, and that
+        comparing a report with itself finds no accuracy regressions.
+        '''
+        report = run(sizes=(50,), repeat=1)
+
+        cases = set((r['function'], r['region']) for r in report['results'])
+        self.assertEqual( len(cases), 4*len(REGIONS)+3 )
+        self.assertEqual( compare(report, report, speed_tol=0), [] )
+
+        #Report must be serializable
+        json.dumps(report)
+
+    def test_RestoresBackend(self):
+        '''
+        Test that pinning a backend for a run leaves the default unchanged.
+        '''
+        previous = erftools.get_backend()
+        report = run(sizes=(10,), functions=['w_vec'], backend='numpy',
+                     repeat=1)
+
+        self.assertEqual( report['meta']['backend'], 'numpy' )
+        self.assertEqual( erftools.get_backend(), previous )
+
+    def test_Regions(self):
+        '''
+        Test that the inner and outer regions sample the right parts of the
+        first quadrant.
+        '''
+        rng = np.random.default_rng(1)
+        zi = region_points('inner', 1000, rng)
+        zo = region_points('outer', 1000, rng)
+
+        self.assertTrue( np.all(np.logical_and(zi.real < 5.33, zi.imag < 4.29)) )
+        self.assertTrue( np.all(np.logical_or(zo.real >= 5.33, zo.imag >= 4.29)) )
+
+
+#Run tests if in main namespace, or run the benchmark from the command line
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        sys.exit(main())
+
+    unittest.main(argv=[''],verbosity=2,exit=False)
@@ -4,36 +4,261 @@ Author: Alexander Hickey
 This python library contains functions used to compute the complex
 error function. A testing framework is built in, and can be run 
 by loading this file into the __main__ namespace.
+
+If the bundled TOMS680 Fortran routine has been compiled with
+    f2py -c toms680_f2py.f -m toms680_f2py
+then w, w_vec, erf and erf_vec use it by default, otherwise they fall back
+to the numpy implementation of the Gautschi algorithm. Use set_backend or
+the backend keyword to pin one, and get_backend to see which is active.
+The vector functions also take dtype=np.complex64, which runs the numpy
+implementation in single precision for about 6 significant figures.
+
+erf_family computes erf, erfc, erfcx, erfi and the Dawson function at the
+same points from a single evaluation of w(z), and erf_zeros finds many
+complex zeros of erf(z) - c at once.
+
+Workloads that evaluate w(z) repeatedly on a bounded region can instead use
+a FaddeevaTable, which interpolates a precomputed, memory-mapped grid.
 """
 
+import json
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
-def erf_taylor(z, nterms=19):
+#Optional compiled backend
+try:
+    import toms680_f2py as _toms680
+except ImportError:
+    _toms680 = None
+
+#Available backends, and the default when none is requested
+BACKENDS = ('numpy', 'toms680')
+_backend = 'numpy' if _toms680 is None else 'toms680'
+
+#Number of elements processed at a time by erf_taylor, chosen so that the
+#working arrays stay in cache
+CHUNK = 2**16
+
+#Number of neighbouring elements that share a series order in erf_taylor
+#when a tolerance is given
+BLOCK = 512
+
+#Thread pools used by w_vec and erf_vec, keyed by number of workers
+_executors = {}
+
+#Parameters of the Gautschi algorithm for each precision, as
+#(x0, y0, h0, N0, N1, nu0, nu1, nu_out): the inner region is y < y0 and
+#x < x0, where s = (1-y/y0)sqrt(1-x^2/x0^2), h = h0 s, and the Taylor sum
+#and continued fraction use N0 + N1 s and nu0 + nu1 s terms. Outside of it
+#the continued fraction uses nu_out terms.
+#The complex64 parameters were tuned for a relative error of about 1e-6 in
+#the first quadrant (measured max 1.1e-6 in single precision over
+#|z| < 1e3, against scipy.special.wofz), and need about half as many
+#iterations. In the lower half plane w(z) = 2exp(-z^2) - w(-z) cancels,
+#so there the error is about 1e-6 relative to |exp(-z^2)| instead (up to
+#5e-5 relative to |w| for |Re z|, |Im z| < 5).
+GAUTSCHI = {np.complex128: (5.33, 4.29, 1.6, 6, 23, 9, 21, 8),
+            np.complex64: (5.33, 4.29, 1.2, 5, 14, 5, 14, 4)}
+
+#Radius within which erf = 1 - exp(-z^2) w(iz) cancels, and the Maclaurin
+#series is summed instead
+SMALL_Z = 0.5
+
+
+def _taylor_coef(nterms):
+    '''
+    Coefficients of the Maclaurin series erf(z) = z*sum_n a_n (-z^2)^n.
+    
+    Args:
+        nterms: Number of terms in the series
+        
+    Return:
+        a: Array of coefficients a_n = 2/sqrt(pi)/(n!(2n+1))
+    '''
+    
+    a = np.zeros(nterms)
+    c = 2.0 / np.sqrt(np.pi)
+    
+    for n in range(nterms):
+        
+        #Running factorial, underflows gracefully to zero
+        if n > 0:
+            c /= n
+        
+        a[n] = c/(2*n+1)
+        
+    return a
+
+
+def _taylor_radii(nterms, tol):
+    '''
+    Largest |z| for which N terms of the Maclaurin series reach a relative
+    tolerance, for N = 1, ..., nterms. The first omitted term relative to
+    the leading one is |z|^(2N)/(N!(2N+1)), and for |z|^2 <= (N+1)/2 the
+    rest of the tail adds at most as much again.
+    
+    Args:
+        nterms: Maximum number of terms
+        tol: Tolerance relative to the leading term 2z/sqrt(pi)
+        
+    Return:
+        radii: Array, radii[N-1] is the radius of convergence for N terms
+    '''
+    
+    radii = np.zeros(nterms)
+    
+    for N in range(1,nterms+1):
+        
+        #Bound on the first omitted term, and on the geometric tail
+        r_term = math.exp((math.log(tol/2) + math.lgamma(N+1)
+                           + math.log(2*N+1))/(2*N))
+        r_tail = math.sqrt((N+1)/2)
+        
+        radii[N-1] = min(r_term, r_tail)
+    
+    #More terms never need a smaller radius
+    return np.maximum.accumulate(radii)
+
+
+def erf_taylor(z, nterms=19, out=None, chunk=CHUNK, tol=None,
+               return_terms=False):
     '''
     Compute the standard error function using a Laurent series about z=0.
+    The series is summed with Horner's rule one chunk of the input at a
+    time, so memory use does not grow with nterms.
+    
+    If tol is given, each block of BLOCK neighbouring elements only uses as
+    many terms as its largest |z| needs for the truncation error to fall
+    below tol relative to the leading term 2z/sqrt(pi), up to a maximum of
+    nterms. Elements near the origin then converge in a handful of terms.
     
     Args:
         z: Array-like, collection of complex numbers
-        nterms: Number of terms in the Taylor series to use
+        nterms: Number of terms in the Taylor series to use, or the maximum
+                number of terms if tol is given
+        out: Optional C-contiguous complex128 array with the shape of z,
+             used to store the result
+        chunk: Number of elements evaluated at a time
+        tol: Optional relative tolerance used to pick the number of terms
+             for each element
+        return_terms: If True, also return the number of terms used
         
     Return:
         erf_z: Error function evaluated at each number
+        terms: Number of terms used for each number (if return_terms)
     '''
     
     #Cast to numpy array
-    z = np.array(z)
+    z = np.asarray(z)
+    
+    #Array to store the result in
+    if out is None:
+        out = np.empty(z.shape, dtype=np.complex128)
+        
+    elif (out.shape != z.shape or out.dtype != np.complex128
+          or not out.flags.c_contiguous):
+        raise ValueError('out must be a C-contiguous complex128 array of '
+                         'shape {}'.format(z.shape))
+    
+    #Series coefficients, including the 2/sqrt(pi) prefactor
+    a = _taylor_coef(nterms)
+    
+    #Number of terms used by each element, only allocated if requested
+    if return_terms:
+        terms = np.full(z.shape, nterms)
+        termsf = terms.reshape(-1)
+    if tol is not None:
+        radii = _taylor_radii(nterms, tol)
     
-    #Array to keep track of terms in series
-    terms = np.zeros((nterms,)+z.shape, dtype=np.complex128)
+    #Flat views of input and output
+    zf, outf = z.reshape(-1), out.reshape(-1)
+    
+    #Work buffers for one chunk, padded to a whole number of blocks and
+    #reused by every chunk
+    size = -(-min(chunk, zf.size) // BLOCK) * BLOCK
+    zb = np.zeros(size, dtype=np.complex128)
+    z2, res = zb.copy(), zb.copy()
+    
+    for i in range(0, zf.size, chunk):
+        
+        zc, outc = zf[i:i+chunk], outf[i:i+chunk]
+        
+        if nterms < 1:
+            outc[:] = 0
+            continue
+        
+        #Horner's rule in -z^2, starting from the highest order term
+        if tol is None:
+            
+            z2c = z2[:zc.size]
+            np.multiply(zc, zc, out=z2c)
+            np.negative(z2c, out=z2c)
+            
+            outc[:] = a[-1]
+            for n in range(nterms-2,-1,-1):
+                outc *= z2c
+                outc += a[n]
+                
+            outc *= zc
+            
+        else:
+            
+            #View the chunk as blocks, padding with zeros if it does not
+            #split into whole blocks
+            nb = -(-zc.size // BLOCK)
+            padded = zc.size != nb*BLOCK
+            if not padded:
+                zbb, outb = zc.reshape(nb,BLOCK), outc.reshape(nb,BLOCK)
+            else:
+                zb[:zc.size] = zc
+                zb[zc.size:] = 0
+                zbb = outb = zb[:nb*BLOCK].reshape(nb,BLOCK)
+            
+            #Smallest number of terms whose radius covers each block
+            rb = np.max(np.abs(zbb), axis=1)
+            nc = np.minimum(np.searchsorted(radii, rb) + 1, nterms)
+            if return_terms:
+                termsf[i:i+chunk] = np.repeat(nc, BLOCK)[:zc.size]
+            
+            #Sort blocks by number of terms, so that the blocks still
+            #active at order n always form a leading slice. The sort is
+            #skipped when the blocks are already in order.
+            n_act = np.cumsum(np.bincount(nc, minlength=nterms+1)[::-1])[::-1]
+            z2b = z2[:nb*BLOCK].reshape(nb,BLOCK)
+            if np.any(np.diff(nc) > 0):
+                order = np.argsort(-nc, kind='stable')
+                np.take(zbb, order, axis=0, out=z2b)
+                np.multiply(z2b, z2b, out=z2b)
+            else:
+                order = None
+                np.multiply(zbb, zbb, out=z2b)
+            np.negative(z2b, out=z2b)
+            
+            #Blocks join the sum with zero at their highest order term
+            resb = res[:nb*BLOCK].reshape(nb,BLOCK)
+            resb[:] = 0
+            for n in range(nterms-1,-1,-1):
+                m = n_act[n+1]
+                resb[:m] *= z2b[:m]
+                resb[:m] += a[n]
+            
+            #Undo the sort
+            if order is not None:
+                outb[order] = resb
+            else:
+                outb[:] = resb
+            
+            if padded:
+                outc[:] = zb[:zc.size]
+            outc *= zc
     
-    #Generate terms in series
-    terms[0] = z
-    z2 = -z*z
-    for n in range(1,nterms):
-        terms[n] = terms[n-1] * z2 / n * (2*n-1)/(2*n+1)
+    if return_terms:
+        return out, terms
     
-    #Sum over array of terms
-    return np.sum(terms, axis=0) * 2.0 / np.sqrt(np.pi)
+    return out
 
 
 
@@ -102,7 +327,7 @@ def wQ1(z):
     
 
 
-def wQ1_vec(z):
+def wQ1_vec(z, dtype=np.complex128):
     '''
     Compute the Faddeeva function in the first quadrant of the complex plane.
     Algorithm is garunteed an accuracy of at least 10 significant figures,
@@ -111,88 +336,272 @@ def wQ1_vec(z):
     
     Args:
         z: Array of complex numbers in the first quadrant (Re >= 0 and Im >=0)
+        dtype: np.complex128, or np.complex64 for about 6 significant figures
         
     Return:
         w(z): Faddeeva function at z
     '''
     
+    #Cast to numpy array
+    dtype, params = _check_dtype(dtype)
+    z = np.asarray(z, dtype=dtype)
+    
     #Separate real and imaginary parts
-    x, y = np.real(z), np.imag(z)
+    re, im = _wQ1_xy(np.real(z).ravel(), np.imag(z).ravel(), params)
+    
+    return (re+im*1.0j).reshape(z.shape)
+
+
+def _wQ1_xy(x, y, params=GAUTSCHI[np.complex128]):
+    '''
+    Real arithmetic kernel of wQ1_vec.
+    
+    Args:
+        x: Flat array of real parts, x >= 0
+        y: Flat array of imaginary parts, y >= 0
+        params: Region and iteration parameters, see GAUTSCHI
+        
+    Return:
+        re, im: Real and imaginary parts of w(x+iy), with the dtype of x
+    '''
     
     #The remainder of the algorithm is based on the algorithm:
     #https://dl.acm.org/citation.cfm?id=363618
-    #Several modifications are made to use numpy array algebra by
-    #replacing if/else statements with boolean arrays
+    #Each element runs exactly the nu iterations it needs, as in wQ1
+    x0, y0, h0, N0, N1, nu0, nu1, nu_out = params
     
-    #Mask inner and outer regions of algorithm
-    inner = np.logical_and(y<4.29,x<5.33)*1.
-    outer = np.logical_not(inner)*1.
+    #Mask inner region of algorithm
+    inner = np.logical_and(y<y0,x<x0)
     
-    #Define algorithm parameter arrays
-    s= (1-y/4.29)*np.abs(np.sqrt(1-x*x/28.41+0.0j))*inner
-    h= (1.6*s)*inner
+    #Define algorithm parameter arrays (s=0 in the outer region)
+    s = np.where(inner, (1-y/y0)*np.sqrt(np.where(inner,1-x*x/(x0*x0),0.)),
+                 0.).astype(x.dtype)
+    h = h0*s
     h2 = 2*h
-    capn = ((6+23*s)*inner+0*outer).astype(int)
-    nu = ((9+21*s)*inner +8*outer).astype(int)
-    lamb = (h2**capn)*((h>0)*1)
+    capn = np.where(inner, N0+N1*s, 0).astype(int)
+    nu = np.where(inner, nu0+nu1*s, nu_out).astype(int)
+    lamb = np.where(h>0, h2**capn, 0.).astype(x.dtype)
     b = np.logical_or(h==0,lamb==0)
     
-    #Initialize a bunch of stuff
-    r1 = np.zeros(z.shape)
+    #nu and capn are both non-decreasing in s, so after sorting by s the
+    #elements still active at step n always form a leading slice
+    order = np.argsort(-s, kind='stable')
+    x, y, h2, lamb = x[order], y[order], h2[order], lamb[order]
+    yh = y+h[order]
+    
+    #Number of elements active in the recurrence at each step n
+    nustart = np.max(nu, initial=0)
+    n_act = np.cumsum(np.bincount(nu, minlength=nustart+1)[::-1])[::-1]
+    
+    #Number of elements accumulating the Taylor sum at each step n
+    n_sum = np.cumsum(np.bincount(capn[h>0], minlength=nustart+1)[::-1])[::-1]
+    
+    #Preallocate work buffers, reused by every iteration
+    r1 = np.zeros(x.shape, dtype=x.dtype)
     r2, s1, s2 = r1.copy(), r1.copy(), r1.copy()
     t1, t2, c = r1.copy(), r1.copy(), r1.copy()
     
-    #Maximum index required to process entire array
-    nustart = np.max(nu)
-    
     for n in range(nustart,-1,-1):
         
         #Update counter
         np1 = n+1
         
-        #Only act on elements with positive counters
-        mask_act = (nu>0)*1
+        #Only act on elements with nu >= n
+        m = n_act[n]
         
-        #Negate mask
-        mask_ignore = np.logical_not(mask_act)*1
+        #Update parameters in place
+        np.multiply(r1[:m], np1, out=t1[:m])
+        np.add(yh[:m], t1[:m], out=t1[:m])
+        np.multiply(r2[:m], np1, out=t2[:m])
+        np.subtract(x[:m], t2[:m], out=t2[:m])
+        np.multiply(t1[:m], t1[:m], out=c[:m])
+        np.multiply(t2[:m], t2[:m], out=r1[:m])
+        np.add(c[:m], r1[:m], out=c[:m])
+        np.divide(.5, c[:m], out=c[:m])
+        np.multiply(c[:m], t1[:m], out=r1[:m])
+        np.multiply(c[:m], t2[:m], out=r2[:m])
         
-        #Update parameters
-        t1 = (y+h+np1*r1)*mask_act + t1*mask_ignore
-        t2 = (x-np1*r2)*mask_act + t2*mask_ignore
-        c= .5/(t1*t1+t2*t2)*mask_act + c*mask_ignore
-        r1 = (c*t1)*mask_act + r1*mask_ignore
-        r2 = (c*t2)*mask_act+ r2*mask_ignore
+        #Only accumulate on elements with h > 0 and n <= capn
+        k = n_sum[n]
         
-        #More masks
-        mask2 = np.logical_and(n<=capn,h>0)*1
-        mask2not = np.logical_not(mask2)*1
+        if k > 0:
             
-        #Update parameters
-        t1 = (lamb + s1)*mask2 + t1*mask2not
-        s1 = (r1*t1-r2*s2)*mask2+ s1*mask2not
-        s2 = (r2*t1+r1*s2)*mask2+ s1*mask2not
-        lamb = (lamb/(h2+mask2not))*mask2+ lamb*mask2not
+            #Update parameters in place (t2 and c are free at this point)
+            np.add(lamb[:k], s1[:k], out=t1[:k])
+            np.multiply(r1[:k], t1[:k], out=s1[:k])
+            np.multiply(r2[:k], s2[:k], out=t2[:k])
+            np.subtract(s1[:k], t2[:k], out=s1[:k])
+            np.multiply(r1[:k], s2[:k], out=s2[:k])
+            np.multiply(r2[:k], t1[:k], out=c[:k])
+            np.add(s2[:k], c[:k], out=s2[:k])
+            np.divide(lamb[:k], h2[:k], out=lamb[:k])
     
-    #Result
-    re =np.exp(-x*x)*(y==0)+1.12837916709551*(r1*b+s1*np.logical_not(b))*(y!=0)
-    im = 1.12837916709551*(r2*b+s2*np.logical_not(b))
+    #Undo the sort
+    b = b[order]
+    c = x.dtype.type(1.12837916709551)
+    re, im = np.empty_like(x), np.empty_like(x)
+    re[order] = np.where(y==0, np.exp(-x*x), c*np.where(b,r1,s1))
+    im[order] = c*np.where(b,r2,s2)
     
-    return re+im*1.0j
+    return re, im
+
+
+def _wQ1_imag(y, params=GAUTSCHI[np.complex128]):
+    '''
+    Compute the Faddeeva function on the positive imaginary axis, where
+    w(iy) = erfcx(y) is real. With x = 0 the imaginary parts r2 and s2 of the
+    recurrence in _wQ1_xy vanish identically, so only the real parts are
+    iterated.
+    
+    Args:
+        y: Flat array of real numbers, y >= 0
+        params: Region and iteration parameters, see GAUTSCHI
+        
+    Return:
+        w(iy): Real array, Faddeeva function at iy
+    '''
+    
+    #Same parameters as _wQ1_xy at x = 0
+    x0, y0, h0, N0, N1, nu0, nu1, nu_out = params
+    inner = y<y0
+    s = np.where(inner, 1-y/y0, 0.).astype(y.dtype)
+    h = h0*s
+    h2 = 2*h
+    capn = np.where(inner, N0+N1*s, 0).astype(int)
+    nu = np.where(inner, nu0+nu1*s, nu_out).astype(int)
+    lamb = np.where(h>0, h2**capn, 0.).astype(y.dtype)
+    b = np.logical_or(h==0,lamb==0)
     
+    #Sort so that the active elements form a leading slice, as in _wQ1_xy
+    order = np.argsort(-s, kind='stable')
+    h2, lamb = h2[order], lamb[order]
+    yh = y[order]+h[order]
+    
+    nustart = np.max(nu, initial=0)
+    n_act = np.cumsum(np.bincount(nu, minlength=nustart+1)[::-1])[::-1]
+    n_sum = np.cumsum(np.bincount(capn[h>0], minlength=nustart+1)[::-1])[::-1]
+    
+    #Preallocate work buffers
+    r1 = np.zeros(y.shape, dtype=y.dtype)
+    s1, t1 = r1.copy(), r1.copy()
+    
+    for n in range(nustart,-1,-1):
+        
+        #r1 = 1/2/(y + h + (n+1) r1)
+        m = n_act[n]
+        np.multiply(r1[:m], n+1, out=t1[:m])
+        np.add(yh[:m], t1[:m], out=t1[:m])
+        np.divide(.5, t1[:m], out=r1[:m])
+        
+        #s1 = r1 (lambda + s1)
+        k = n_sum[n]
+        
+        if k > 0:
+            
+            np.add(lamb[:k], s1[:k], out=s1[:k])
+            np.multiply(r1[:k], s1[:k], out=s1[:k])
+            np.divide(lamb[:k], h2[:k], out=lamb[:k])
+    
+    #Undo the sort
+    res = np.empty_like(y)
+    res[order] = y.dtype.type(1.12837916709551)*np.where(b[order],r1,s1)
+    res[y==0] = 1.0
+    
+    return res
+    
+
+
+def get_backend():
+    '''
+    Report the backend used by w, w_vec, erf and erf_vec by default.
+    
+    Return:
+        backend: Either 'numpy' or 'toms680'
+    '''
+    
+    return _backend
+
+
+def set_backend(backend):
+    '''
+    Pin the backend used by w, w_vec, erf and erf_vec by default.
+    
+    Args:
+        backend: Either 'numpy' or 'toms680'
+    '''
+    
+    global _backend
+    _backend = _check_backend(backend)
 
 
-def w(z):
+def _check_backend(backend):
+    '''
+    Validate a requested backend, where None stands for the default.
+    
+    Args:
+        backend: Either None, 'numpy' or 'toms680'
+        
+    Return:
+        backend: Name of the backend to use
+    '''
+    
+    if backend is None:
+        return _backend
+    
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {}, expected one of {}'
+                         .format(backend, BACKENDS))
+    
+    if backend == 'toms680' and _toms680 is None:
+        raise ImportError('The toms680 backend needs the compiled extension,'
+                          ' build it with f2py -c toms680_f2py.f'
+                          ' -m toms680_f2py')
+    
+    return backend
+
+
+def _check_dtype(dtype):
+    '''
+    Validate a requested precision for the vector kernels.
+    
+    Args:
+        dtype: np.complex128 or np.complex64
+        
+    Return:
+        dtype: Complex numpy dtype
+        params: Parameters of the Gautschi algorithm for that precision
+    '''
+    
+    dtype = np.dtype(dtype)
+    
+    if dtype.type not in GAUTSCHI:
+        raise ValueError('Unsupported dtype {}, expected complex128 or '
+                         'complex64'.format(dtype))
+    
+    return dtype, GAUTSCHI[dtype.type]
+
+
+def w(z, backend=None):
     '''
     Compute the Faddeeva function in any quadrant of the complex plane, by
     mapping it to the first quadrant with symmetry properties.
     
     Args:
         z: Single complex number
+        backend: 'numpy' or 'toms680', defaults to get_backend()
         
     Return:
         w(z): Faddeeva function at z
     '''
     
+    if _check_backend(backend) == 'toms680':
+        
+        u, v, flag = _toms680.wofz(np.real(z), np.imag(z))
+        
+        #Overflow flagged by TOMS680 is left to the numpy algorithm
+        if not flag:
+            return u+v*1.0j
+    
     #Real and imaginary parts
     re, im = np.real(z), np.imag(z)
     
@@ -219,39 +628,220 @@ def w(z):
     
     
     
-def w_vec(z):
+def _threaded(func, z, workers, out_dtype=np.complex128, **kwargs):
+    '''
+    Evaluate an elementwise function on contiguous chunks of an array using
+    a thread pool. The numpy ufuncs and the compiled backend release the
+    GIL, so the chunks run in parallel without the pickling cost of a
+    process pool.
+    
+    Args:
+        func: Function of an array, called as func(chunk, **kwargs)
+        z: Array of numbers
+        workers: Number of threads
+        out_dtype: Data type of the output
+        
+    Return:
+        func(z): Results of all chunks, written into one output array
+    '''
+    
+    if workers not in _executors:
+        _executors[workers] = ThreadPoolExecutor(max_workers=workers)
+    
+    zf = z.reshape(-1)
+    out = np.empty(z.shape, dtype=out_dtype)
+    outf = out.reshape(-1)
+    
+    #A few chunks per worker to even out the load, but no smaller than CHUNK
+    size = max(CHUNK, -(-zf.size // (4*workers)))
+    
+    def run(i):
+        outf[i:i+size] = func(zf[i:i+size], **kwargs)
+    
+    #Consume the iterator so that exceptions are raised here
+    list(_executors[workers].map(run, range(0, zf.size, size)))
+    
+    return out
+
+
+def w_vec(z, backend=None, workers=None, dtype=np.complex128):
     '''
     Compute the Faddeeva function in any quadrant of the complex plane, by
     mapping it to the first quadrant with symmetry properties. 
-    Modified to handle vector input.
+    Modified to handle vector input. Real input is evaluated on the real
+    axis without forming complex arguments.
     
     Args:
-        z: Array of complex numbers
-        
+        z: Array of complex or real numbers
+        backend: 'numpy' or 'toms680', defaults to get_backend()
+        workers: Number of threads to split large inputs over, None or 1
+                 evaluates in the calling thread
+        dtype: np.complex128, or np.complex64 to compute in single precision
+               with about 6 significant figures (always uses numpy)
+
     Return:
         w(z): Faddeeva function at z
     '''
-    
+
+    #Cast to numpy array, keeping real input real
+    dtype, params = _check_dtype(dtype)
+    z = np.asarray(z)
+    real = np.isrealobj(z)
+    z = z.astype(np.finfo(dtype).dtype if real else dtype, copy=False)
+
+    if workers is not None and workers > 1 and z.size > CHUNK:
+        return _threaded(w_vec, z, workers, out_dtype=dtype, backend=backend,
+                         dtype=dtype)
+
+    #The compiled backend is double precision only
+    if dtype == np.complex64:
+        backend = 'numpy'
+
+    if real:
+        return _w_real(z, backend, params)
+
+    #f2py rejects empty arrays, and there is nothing to compute
+    if z.size == 0:
+        return np.zeros(z.shape, dtype)
+
     #Real and imaginary parts
     re, im = np.real(z), np.imag(z)
+
+    if _check_backend(backend) == 'toms680':
+
+        u, v, flag = _toms680.wofzv(re.ravel(), im.ravel())
+        res = (u+v*1.0j).reshape(z.shape)
+
+        #Overflow flagged by TOMS680 is left to the numpy algorithm
+        flag = flag.reshape(z.shape).astype(bool)
+        if np.any(flag):
+            res[flag] = w_vec(z[flag], backend='numpy')
+
+        return res
+
+    #Every quadrant maps onto |Re z| + i|Im z| in the first quadrant, so
+    #the recurrence only needs to be run once on the whole array
+    return _unfold_Q1(z, wQ1_vec(np.abs(re) + 1.0j*np.abs(im), dtype))
+
+
+def _w_real(x, backend=None, params=GAUTSCHI[np.complex128]):
+    '''
+    Compute the Faddeeva function on the real axis, using the first
+    quadrant kernel at |x| and w(-x) = conj(w(x)).
     
-    #Masks corresponding to each quadrant
-    m1 = np.logical_and(re > 0,im >= 0)
-    m2 = np.logical_and(re <= 0,im > 0)
-    m3 = np.logical_and(re < 0,im <= 0)
-    m4 = np.logical_and(re >= 0,im < 0)
-    m0 = np.logical_and(re == 0,im == 0) #Don't forget origin!
+    Args:
+        x: Array of real numbers
+        backend: 'numpy' or 'toms680', defaults to get_backend()
+        params: Parameters of the numpy kernel, see GAUTSCHI
+        
+    Return:
+        w(x): Faddeeva function at x
+    '''
+    
+    #f2py rejects empty arrays, and there is nothing to compute
+    if x.size == 0:
+        return np.zeros(x.shape, np.result_type(x, 1.0j))
     
-    #Compute the result for each quadrant using symmetry properties
-    resQ1 = wQ1_vec(z)
-    resQ2 = np.conj(wQ1_vec(-np.conj(z)))
-    resQ3 = 2*np.exp(-z*z)-wQ1_vec(-z)
-    resQ4 = 2*np.exp(-z*z)-np.conj(wQ1_vec(np.conj(z)))
+    xf = x.ravel()
+    
+    if _check_backend(backend) == 'toms680':
+        
+        #No overflow is possible on the real axis
+        re, im, flag = _toms680.wofzv(xf, np.zeros(xf.shape))
+        
+    else:
+        
+        re, im = _wQ1_xy(np.abs(xf), np.zeros_like(xf), params)
+        np.negative(im, out=im, where=xf<0)
     
-    return resQ1*m1+resQ2*m2+resQ3*m3+resQ4*m4+1.0*m0
+    return (re+im*1.0j).reshape(x.shape)
 
 
-def erf(z):
+def _erf_real(x, backend=None, params=GAUTSCHI[np.complex128]):
+    '''
+    Compute the error function on the real axis in real arithmetic, from
+    erf(x) = sign(x)(1 - exp(-x^2) w(i|x|)), where w(i|x|) = erfcx(|x|) is
+    real. For |x| < SMALL_Z, where this cancels, the Maclaurin series is
+    summed instead.
+    
+    Args:
+        x: Array of real numbers
+        backend: 'numpy' or 'toms680', defaults to get_backend()
+        params: Parameters of the numpy kernel, see GAUTSCHI
+        
+    Return:
+        erf(x): Real array, error function at x
+    '''
+    
+    #f2py rejects empty arrays, and there is nothing to compute
+    if x.size == 0:
+        return np.zeros(x.shape, x.dtype)
+    
+    xf = x.ravel()
+    y = np.abs(xf)
+    
+    if _check_backend(backend) == 'toms680':
+        
+        #No overflow is possible on the positive imaginary axis
+        wy, v, flag = _toms680.wofzv(np.zeros(y.shape), y)
+        
+    else:
+        
+        wy = _wQ1_imag(y, params)
+    
+    #erf(|x|) = 1 - erfc(|x|), with the sign of x restored
+    np.multiply(y, -y, out=y)
+    np.exp(y, out=y)
+    np.multiply(y, wy, out=y)
+    res = np.subtract(1.0, y, out=y)
+    np.copysign(res, xf, out=res)
+    
+    #Maclaurin series near the origin
+    small = np.abs(xf) < SMALL_Z
+    
+    if np.any(small):
+        
+        xs = xf[small]
+        res[small] = xs*np.polynomial.polynomial.polyval(-xs*xs,
+                                                         _taylor_coef(19))
+    
+    return res.reshape(x.shape)
+
+
+def _unfold_Q1(z, res):
+    '''
+    Map values of the Faddeeva function at |Re z| + i|Im z| back to z, using
+    its symmetry properties. The input array is modified in place.
+    
+    Args:
+        z: Array of complex numbers
+        res: Faddeeva function at |Re z| + i|Im z|
+        
+    Return:
+        w(z): Faddeeva function at z
+    '''
+
+    #Real and imaginary parts
+    re, im = np.real(z), np.imag(z)
+
+    #Second and fourth quadrants pick up a complex conjugate
+    m_conj = np.logical_or(np.logical_and(re <= 0,im > 0),
+                           np.logical_and(re >= 0,im < 0))
+    np.conjugate(res, out=res, where=m_conj)
+
+    #Third and fourth quadrants use w(-z) = 2exp(-z^2) - w(z), which is
+    #only evaluated on the elements that need it
+    m_refl = np.logical_or(im < 0, np.logical_and(re < 0,im == 0))
+    z_refl = z[m_refl]
+    res[m_refl] = 2*np.exp(-z_refl*z_refl)-res[m_refl]
+
+    #Don't forget origin!
+    res[np.logical_and(re == 0,im == 0)] = 1.0
+
+    return res
+
+
+def erf(z, backend=None):
     '''
     Compute the error function in the complex plane.
     Algorithm is garunteed an accuracy of at least 10 significant figures,
@@ -259,29 +849,492 @@ def erf(z):
     
     Args:
         z: Single complex number
+        backend: 'numpy' or 'toms680', defaults to get_backend()
         
     Return:
         erf(z): Error function at z
     '''
     
-    return 1-np.exp(-z*z)*w(1.0j*z)
+    return 1-np.exp(-z*z)*w(1.0j*z, backend=backend)
 
 
-def erf_vec(z):
+def erf_vec(z, backend=None, workers=None, dtype=np.complex128):
     '''
     Compute the error function in complex plane.
     Algorithm is garunteed an accuracy of at least 10 significant figures,
     see: https://dl.acm.org/citation.cfm?id=363618. Modified to handle vector
-    input.
+    input. Real input is evaluated with a real kernel and gives real output.
     
     Args:
-        z: Array of complex numbers
+        z: Array of complex or real numbers
+        backend: 'numpy' or 'toms680', defaults to get_backend()
+        workers: Number of threads to split large inputs over, None or 1
+                 evaluates in the calling thread
+        dtype: np.complex128, or np.complex64 to compute in single precision
+               with about 6 significant figures (always uses numpy)
         
     Return:
         erf(z): Error function at z
     '''
 
-    return 1.0-np.exp(-z*z)*w_vec(1.0j*z)
+    #Cast to numpy array, keeping real input real
+    dtype, params = _check_dtype(dtype)
+    z = np.asarray(z)
+    real = np.isrealobj(z)
+    z = z.astype(np.finfo(dtype).dtype if real else dtype, copy=False)
+
+    if workers is not None and workers > 1 and z.size > CHUNK:
+        return _threaded(erf_vec, z, workers, out_dtype=z.dtype,
+                         backend=backend, dtype=dtype)
+
+    #The compiled backend is double precision only
+    if dtype == np.complex64:
+        backend = 'numpy'
+
+    if real:
+        return _erf_real(z, backend, params)
+
+    return 1.0-np.exp(-z*z)*w_vec(1.0j*z, backend=backend, dtype=dtype)
+
+
+#Members of the error function family computed by erf_family
+FAMILY = ('erf', 'erfc', 'erfcx', 'erfi', 'dawson')
+
+
+def erf_family(z, funcs=FAMILY, backend=None, workers=None):
+    '''
+    Compute several members of the error function family at the same
+    points from a single evaluation of the Faddeeva function, using
+        erfcx(z) = w(iz)
+        erfc(z) = exp(-z^2) w(iz)
+        erf(z) = 1 - exp(-z^2) w(iz)
+        erfi(z) = i(1 - exp(z^2) w(z))
+        dawson(z) = i sqrt(pi)/2 (exp(-z^2) - w(z))
+    erfcx is returned directly, so it stays finite where exp(z^2) overflows.
+    In the left half plane exp(-z^2) overflows and w(iz) underflows, so
+    there w is evaluated at -iz and the reflections
+        erfcx(z) = 2 exp(z^2) - w(-iz)
+        erfc(z) = 2 - exp(-z^2) w(-iz)
+    are used instead.
+    erf, erfi and dawson cancel near the origin, so for |z| < SMALL_Z they
+    are instead taken from the Maclaurin series in erf_taylor.
+    When members of both groups are requested, w is evaluated at iz and z
+    in one call to w_vec.
+
+    Args:
+        z: Array of complex numbers
+        funcs: Names of the functions to compute, a subset of FAMILY
+        backend: 'numpy' or 'toms680', defaults to get_backend()
+        workers: Number of threads used by w_vec
+
+    Return:
+        res: Dictionary mapping each name in funcs to its values at z
+    '''
+
+    for name in funcs:
+        if name not in FAMILY:
+            raise ValueError('Unknown function {}, expected one of {}'
+                             .format(name, FAMILY))
+
+    #Cast to numpy array, with at least one dimension so that the series
+    #can be assigned by mask
+    z = np.asarray(z, dtype=np.complex128)
+    shape = z.shape
+    z = np.atleast_1d(z)
+
+    #Arguments of w needed by the requested functions, reflected into the
+    #right half plane for the erfc group
+    left = z.real < 0
+    need_iz = any(name in funcs for name in ('erf', 'erfc', 'erfcx'))
+    need_z = any(name in funcs for name in ('erfi', 'dawson'))
+    args = [1.0j*np.where(left, -z, z)]*need_iz + [z]*need_z
+
+    wz = w_vec(np.stack(args), backend=backend, workers=workers)
+    w_iz, w_z = wz[0], wz[-1]
+
+    res = {}
+
+    if need_iz:
+
+        if 'erfcx' in funcs:
+            with np.errstate(over='ignore', invalid='ignore'):
+                res['erfcx'] = np.where(left, 2.0*np.exp(z*z)-w_iz, w_iz)
+
+        if 'erfc' in funcs or 'erf' in funcs:
+            ew = np.exp(-z*z)*w_iz
+            res['erfc'] = np.where(left, 2.0-ew, ew)
+            res['erf'] = 1.0-res['erfc']
+
+    if need_z:
+
+        if 'erfi' in funcs:
+            res['erfi'] = 1.0j*(1.0-np.exp(z*z)*w_z)
+
+        if 'dawson' in funcs:
+            res['dawson'] = 0.5j*np.sqrt(np.pi)*(np.exp(-z*z)-w_z)
+
+    #Replace the cancelling members by the series near the origin
+    small = np.abs(z) < SMALL_Z
+
+    if np.any(small) and any(name in funcs for name in ('erf', 'erfi', 'dawson')):
+
+        zs = z[small]
+
+        if 'erf' in funcs:
+            res['erf'][small] = erf_taylor(zs)
+
+        if 'erfi' in funcs or 'dawson' in funcs:
+            erfi_s = -1.0j*erf_taylor(1.0j*zs)
+            if 'erfi' in funcs:
+                res['erfi'][small] = erfi_s
+            if 'dawson' in funcs:
+                res['dawson'][small] = 0.5*np.sqrt(np.pi)*np.exp(-zs*zs)*erfi_s
+
+    return {name: res[name].reshape(shape) for name in funcs}
+
+
+def erfc_vec(z, backend=None, workers=None):
+    '''
+    Compute the complementary error function erfc(z) = 1 - erf(z), see
+    erf_family.
+    '''
+
+    return erf_family(z, ('erfc',), backend, workers)['erfc']
+
+
+def erfcx_vec(z, backend=None, workers=None):
+    '''
+    Compute the scaled complementary error function exp(z^2) erfc(z), see
+    erf_family.
+    '''
+
+    return erf_family(z, ('erfcx',), backend, workers)['erfcx']
+
+
+def erfi_vec(z, backend=None, workers=None):
+    '''
+    Compute the imaginary error function erfi(z) = -i erf(iz), see
+    erf_family.
+    '''
+
+    return erf_family(z, ('erfi',), backend, workers)['erfi']
+
+
+def dawson_vec(z, backend=None, workers=None):
+    '''
+    Compute the Dawson function sqrt(pi)/2 exp(-z^2) erfi(z), see
+    erf_family.
+    '''
+
+    return erf_family(z, ('dawson',), backend, workers)['dawson']
+
+
+def erf_zeros(n, c=0.0, tol=1e-12, max_iter=20, backend=None):
+    '''
+    Compute the first n zeros of erf(z) - c in the first quadrant, ordered
+    by magnitude. All roots are refined together with vectorized Newton
+    steps, using erf'(z) = 2/sqrt(pi) exp(-z^2), so that
+        dz = sqrt(pi)/2 ((1-c) exp(z^2) - w(iz))
+    and each root is frozen once its step falls below tol relative to |z|.
+    
+    The initial guesses come from the asymptotic expansion
+        erfc(z) ~ exp(-z^2)/(z sqrt(pi)) (1 - 1/(2z^2)) = 1-c
+    on the k-th branch of the logarithm, which is already accurate to about
+    1e-4 for the first root and improves with k. The principal branch k=0
+    is tried as well, and gives the smallest root when it converges in the
+    closed first quadrant (e.g. the real root for 0 < c < 1, or a root on
+    the imaginary axis for purely imaginary c). For c = 0 it is the trivial
+    zero z = 0, which is left out as in scipy.special.erf_zeros.
+    
+    Args:
+        n: Number of zeros
+        c: Complex shift, the roots solve erf(z) = c (c != 1)
+        tol: Relative tolerance on the Newton step
+        max_iter: Maximum number of Newton steps
+        backend: 'numpy' or 'toms680', defaults to get_backend()
+        
+    Return:
+        z0: Array of n complex zeros
+    '''
+    
+    if c == 1:
+        raise ValueError('erf(z) = 1 has no finite roots')
+    
+    #Fixed point iteration of z^2 = 2 pi i k - log(1-c) - log(sqrt(pi) z)
+    #                                + log(1 - 1/(2z^2))
+    base = 2j*np.pi*np.arange(1, n+1) - np.log(complex(1-c))
+    z = np.sqrt(base)
+    for _ in range(2):
+        z = np.sqrt(base - np.log(np.sqrt(np.pi)*z) + np.log1p(-0.5/(z*z)))
+    
+    #Principal branch, where |z| is too small for the expansion to help
+    if c != 0:
+        z = np.concatenate(([np.sqrt(-np.log(complex(1-c)))], z))
+    
+    #Newton steps on the roots that have not converged yet
+    active = np.arange(z.size)
+    step = np.zeros(z.size)
+    
+    with np.errstate(all='ignore'):
+        for _ in range(max_iter):
+            
+            za = z[active]
+            dz = 0.5*np.sqrt(np.pi)*((1-c)*np.exp(za*za)
+                                     - w_vec(1.0j*za, backend=backend))
+            z[active] = za - dz
+            step[active] = np.abs(dz)/np.abs(za)
+            
+            active = active[~(np.abs(dz) <= tol*np.abs(za))]
+            if active.size == 0:
+                break
+    
+    #Keep the roots in the closed first quadrant whose last step was within
+    #the accuracy of w, allowing for rounding off the axes
+    keep = np.logical_and(np.isfinite(z), step <= 1e-8)
+    slack = 1e-8*np.abs(z)
+    keep &= np.logical_and(z.real >= -slack, z.imag >= -slack)
+    z = z[keep]
+    
+    return z[np.argsort(np.abs(z), kind='stable')][:n]
+
+
+def voigt(x, centers, sigmas, gammas, jac=False, backend=None, workers=None):
+    '''
+    Compute normalized Voigt profiles V = Re[w(z)]/(sigma sqrt(2 pi)), with
+    z = (x - center + i gamma)/(sigma sqrt(2)), for K lines at M points in a
+    single broadcast evaluation. The derivatives with respect to the line
+    parameters follow analytically from w'(z) = -2z w(z) + 2i/sqrt(pi).
+    
+    Args:
+        x: Array of M points (e.g. wavelengths)
+        centers: Array of K line centers
+        sigmas: Array of K Gaussian widths (standard deviations)
+        gammas: Array of K Lorentzian half widths at half maximum
+        jac: If True, also return the derivatives of the profiles
+        backend: 'numpy' or 'toms680', defaults to get_backend()
+        workers: Number of threads used by w_vec
+        
+    Return:
+        V: (K,M) array of profile values
+        dV: Tuple of (K,M) arrays with the derivatives of V with respect to
+            center, sigma and gamma (if jac)
+    '''
+    
+    #Lines along the first axis, points along the second
+    x = np.asarray(x, dtype=float)[None,:]
+    x0 = np.asarray(centers, dtype=float)[:,None]
+    sigma = np.asarray(sigmas, dtype=float)[:,None]
+    gamma = np.asarray(gammas, dtype=float)[:,None]
+    
+    #Normalization and argument of the Faddeeva function
+    norm = 1.0/(sigma*np.sqrt(2*np.pi))
+    s2 = sigma*np.sqrt(2)
+    z = (x - x0 + 1.0j*gamma)/s2
+    
+    wz = w_vec(z, backend=backend, workers=workers)
+    V = norm*np.real(wz)
+    
+    if not jac:
+        return V
+    
+    #Derivative of w, and chain rule through dz/dcenter = -1/(sigma sqrt 2),
+    #dz/dgamma = i/(sigma sqrt 2) and dz/dsigma = -z/sigma
+    dw = -2*z*wz + 2.0j/np.sqrt(np.pi)
+    dV_center = -norm*np.real(dw)/s2
+    dV_gamma = -norm*np.imag(dw)/s2
+    dV_sigma = -norm*(np.real(z*dw) + np.real(wz))/sigma
+    
+    return V, (dV_center, dV_sigma, dV_gamma)
+
+
+
+
+class FaddeevaTable:
+    '''
+    Table of the Faddeeva function on a regular grid, for workloads that
+    evaluate w(z) many times on the same bounded region.
+    
+    The grid covers [0,xmax] x [0,ymax] in the first quadrant, and the other
+    quadrants are reached with the same symmetry properties as w_vec. It is
+    stored as a .npy file (with a .json file holding its parameters) and
+    memory-mapped, so it is computed once and shared between processes and
+    runs. For every node z0 the table holds the Taylor coefficients
+    c_k = w^(k)(z0)/k! up to the given order, which follow from
+    c_1 = -2 z0 c_0 + 2i/sqrt(pi) and c_(k+1) = (-2 z0 c_k - 2 c_(k-1))/(k+1).
+    A query is then a Horner evaluation about its nearest node.
+    
+    Since |z-z0| <= h/sqrt(2) inside the grid, Cauchy's estimate bounds the
+    truncation error by M q^(order+1)/(1-q), with q = h/(sqrt(2) R) and M the
+    maximum of |w| within a distance R of the grid. This is at most
+    1 + 2exp(R^2), as |w| <= 1 in the upper half-plane and
+    |w(z)| <= 1 + 2exp(y^2-x^2) below it. The smallest such bound over a few
+    values of R is stored in error_bound. It is an absolute error on the
+    first quadrant value, on top of the accuracy of the backend used to
+    build the grid. Points outside the grid are evaluated exactly.
+    '''
+    
+    def __init__(self, path, xmax=6.0, ymax=6.0, h=0.05, order=8,
+                 backend=None):
+        '''
+        Load the table stored at path, or build and store it if the file is
+        missing or was built with different parameters.
+        
+        Args:
+            path: File name of the table, '.npy' is appended if missing
+            xmax: Largest |Re z| covered by the table
+            ymax: Largest |Im z| covered by the table
+            h: Grid spacing
+            order: Order of the Taylor series used between grid nodes
+            backend: Backend used to build the grid and to evaluate points
+                     outside of it, defaults to get_backend()
+        '''
+        
+        if not path.endswith('.npy'):
+            path += '.npy'
+        self.path = path
+        self.meta_path = path[:-4]+'.json'
+        self.backend = _check_backend(backend)
+        
+        #Number of grid nodes, rounding the limits to a whole number of steps
+        nx = int(round(xmax/h)) + 1
+        ny = int(round(ymax/h)) + 1
+        self.meta = {'h': float(h), 'nx': nx, 'ny': ny, 'order': int(order),
+                     'backend': self.backend}
+        self.meta['error_bound'] = self._bound()
+        
+        if self._stored_meta() != self.meta:
+            self._build()
+        
+        #Cold start is a single memory map
+        self.values = np.load(self.path, mmap_mode='r')
+        self.error_bound = self.meta['error_bound']
+    
+    
+    def _stored_meta(self):
+        '''
+        Parameters of the table on disk, or None if there is no table.
+        '''
+        
+        if not (os.path.exists(self.path) and os.path.exists(self.meta_path)):
+            return None
+        
+        with open(self.meta_path) as f:
+            return json.load(f)
+    
+    
+    def _bound(self):
+        '''
+        Cauchy estimate of the truncation error of the Taylor series.
+        '''
+        
+        bound = np.inf
+        for R in (0.25, 0.5, 1.0, 2.0, 4.0):
+            
+            q = self.meta['h']/(np.sqrt(2)*R)
+            if q < 1:
+                M = 1 + 2*np.exp(R*R)
+                bound = min(bound, M*q**(self.meta['order']+1)/(1-q))
+        
+        return float(bound)
+    
+    
+    def _build(self):
+        '''
+        Compute the Taylor coefficients on the grid and store them, writing
+        to temporary files first so that readers never see a partial table.
+        '''
+        
+        m = self.meta
+        x = m['h']*np.arange(m['nx'])
+        y = m['h']*np.arange(m['ny'])
+        z0 = x[None,:] + 1.0j*y[:,None]
+        
+        #Taylor coefficients from the recurrence
+        coef = np.zeros((m['order']+1,)+z0.shape, dtype=np.complex128)
+        coef[0] = w_vec(z0, backend=self.backend)
+        if m['order'] > 0:
+            coef[1] = -2*z0*coef[0] + 2.0j/np.sqrt(np.pi)
+        for k in range(1, m['order']):
+            coef[k+1] = (-2*z0*coef[k] - 2*coef[k-1])/(k+1)
+        
+        folder = os.path.dirname(os.path.abspath(self.path))
+        
+        fd, tmp = tempfile.mkstemp(suffix='.npy', dir=folder)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, coef)
+        os.replace(tmp, self.path)
+        
+        fd, tmp = tempfile.mkstemp(suffix='.json', dir=folder)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(m, f)
+        os.replace(tmp, self.meta_path)
+    
+    
+    def wQ1_vec(self, z):
+        '''
+        Compute the Faddeeva function in the first quadrant from the table,
+        falling back to the exact evaluation outside of it.
+        
+        Args:
+            z: Array of complex numbers in the first quadrant
+            
+        Return:
+            w(z): Faddeeva function at z
+        '''
+        
+        #Cast to numpy array
+        z = np.asarray(z, dtype=np.complex128)
+        m = self.meta
+        
+        #Position of each element in units of the grid spacing
+        fx, fy = np.real(z)/m['h'], np.imag(z)/m['h']
+        inside = np.logical_and(np.logical_and(fx >= 0, fx <= m['nx']-1),
+                                np.logical_and(fy >= 0, fy <= m['ny']-1))
+        
+        res = np.empty(z.shape, dtype=np.complex128)
+        res[~inside] = w_vec(z[~inside], backend=self.backend)
+        
+        #Nearest grid node and displacement from it
+        ix, iy = np.rint(fx[inside]), np.rint(fy[inside])
+        dz = z[inside] - m['h']*(ix + 1.0j*iy)
+        node = (iy*m['nx'] + ix).astype(int)
+        
+        #Horner's rule about the nearest node, one chunk at a time
+        coef = self.values.reshape(m['order']+1, -1)
+        acc = np.empty(dz.shape, dtype=np.complex128)
+        
+        for i in range(0, dz.size, CHUNK):
+            
+            nc, dc, ac = node[i:i+CHUNK], dz[i:i+CHUNK], acc[i:i+CHUNK]
+            
+            np.take(coef[-1], nc, out=ac)
+            for k in range(m['order']-1,-1,-1):
+                ac *= dc
+                ac += np.take(coef[k], nc)
+        
+        res[inside] = acc
+        
+        return res
+    
+    
+    def w_vec(self, z):
+        '''
+        Compute the Faddeeva function in any quadrant of the complex plane
+        from the table, falling back to the exact evaluation outside of it.
+        
+        Args:
+            z: Array of complex numbers
+            
+        Return:
+            w(z): Faddeeva function at z
+        '''
+        
+        #Cast to numpy array
+        z = np.asarray(z, dtype=np.complex128)
+        
+        zq = np.abs(np.real(z)) + 1.0j*np.abs(np.imag(z))
+        
+        return _unfold_Q1(z, self.wQ1_vec(zq))
 
 
 
@@ -311,6 +1364,35 @@ class TestErf(unittest.TestCase):
         
         self.assertTrue( np.any(diff<1e-10) )
     
+    def test_ErfTaylorChunks(self):
+        '''
+        Test that chunked evaluation into a preallocated output gives the
+        same result as a single pass.
+        '''
+        zr = np.random.random((7,5)) + 1.0j*np.random.random((7,5))
+        out = np.empty(zr.shape, dtype=np.complex128)
+        
+        res = erf_taylor(zr, out=out, chunk=3)
+        
+        self.assertIs( res, out )
+        self.assertTrue( np.array_equal(res, erf_taylor(zr)) )
+        self.assertRaises( ValueError, erf_taylor, zr, out=out.T )
+    
+    def test_ErfTaylorTol(self):
+        '''
+        Test that the adaptive series order meets the requested tolerance
+        in the unit disk, using fewer terms near the origin.
+        '''
+        zr = np.zeros(2*BLOCK, dtype=np.complex128)
+        zr[:BLOCK] = 1e-3*np.exp(2.0j*np.pi*np.random.random(BLOCK))
+        zr[BLOCK:] = 0.9*np.exp(2.0j*np.pi*np.random.random(BLOCK))
+        
+        res, terms = erf_taylor(zr, nterms=40, tol=1e-12, return_terms=True)
+        diff = np.abs(res-special.erf(zr))/np.abs(2*zr/np.sqrt(np.pi))
+        
+        self.assertTrue( np.all(diff<1e-12) )
+        self.assertTrue( terms[0] < terms[-1] < 40 )
+    
     def test_ErfZeroes(self):
         '''
         Test that the first 19 zeroes of the erf function correspond
@@ -341,6 +1423,242 @@ class TestErf(unittest.TestCase):
         #Gautschi algorithm.
         self.assertTrue( np.any(erf0<1e-10) )
 
+    def test_ErfZerosNewton(self):
+        '''
+        Test that erf_zeros reproduces scipy.special.erf_zeros, and that the
+        roots of shifted equations erf(z) = c are found as well.
+        '''
+        z0 = erf_zeros(50)
+        self.assertTrue( np.all(np.abs(z0-special.erf_zeros(50)) < 1e-10) )
+        
+        zc = erf_zeros(50, c=0.5+0.5j)
+        self.assertTrue( np.all(np.abs(special.erf(zc)-0.5-0.5j) < 1e-10) )
+        self.assertTrue( np.all(np.diff(np.abs(zc)) > 0) )
+        
+        #Every root inside |z| < 3, found independently by Newton's method
+        #from a grid of starting points
+        for c in (0.5+0.5j, 2j, 0.5, -0.5+0.2j):
+            
+            x, y = np.meshgrid(np.linspace(0,3,31), np.linspace(0,3,31))
+            z = (x + 1.0j*y).ravel()
+            with np.errstate(all='ignore'):
+                for _ in range(60):
+                    z = z - (special.erf(z)-c)*np.sqrt(np.pi)/2*np.exp(z*z)
+            
+            ok = np.abs(special.erf(z)-c) < 1e-10
+            ok &= np.logical_and(z.real > -1e-8, z.imag > -1e-8)
+            ok &= np.abs(z) < 3
+            roots = np.unique(np.round(z[ok], 8))
+            roots = roots[np.argsort(np.abs(roots))]
+            
+            zc = erf_zeros(len(roots), c=c)
+            self.assertTrue( np.all(np.abs(zc-roots) < 1e-7) )
+
+    def test_WVecQuadrants(self):
+        '''
+        Test that w_vec agrees with the scalar w function in every quadrant,
+        on both axes and at the origin.
+        '''
+        #Random points in all four quadrants, plus the axes and origin
+        xr, yr = 6*np.random.random(40)-3, 6*np.random.random(40)-3
+        zr = np.concatenate((xr + 1.0j*yr, xr, 1.0j*yr, [0.0]))
+
+        #Compare to the scalar implementation
+        wz = np.array([w(zr[j]) for j in range(len(zr))])
+        diff = np.abs(w_vec(zr)-wz)/np.abs(wz)
+
+        self.assertTrue( np.all(diff<1e-10) )
+
+    def test_Complex64(self):
+        '''
+        Test the single precision mode of w_vec and erf_vec against
+        scipy.special in the upper half plane and on the real axis.
+        '''
+        xr, yr = 10*np.random.random(100)-5, 5*np.random.random(100)
+        zr = xr + 1.0j*yr
+        
+        wz = w_vec(zr, dtype=np.complex64)
+        ref = special.wofz(zr.astype(np.complex64).astype(complex))
+        
+        self.assertEqual( wz.dtype, np.complex64 )
+        self.assertTrue( np.all(np.abs(wz-ref) < 5e-6*np.abs(ref)) )
+        
+        erfx = erf_vec(xr, dtype=np.complex64)
+        ref = special.erf(xr.astype(np.float32).astype(float))
+        
+        self.assertEqual( erfx.dtype, np.float32 )
+        self.assertTrue( np.all(np.abs(erfx-ref) < 5e-6*np.abs(ref)) )
+        self.assertRaises( ValueError, w_vec, zr, dtype=np.float64 )
+
+    def test_WQ1VecBatch(self):
+        '''
+        Test that each element of wQ1_vec runs its own number of iterations,
+        so that the result does not depend on the rest of the array.
+        '''
+        #Points in the outer region, alone and mixed with inner points
+        zo = 6*np.random.random(10) + 5.0j
+        zi = np.random.random(10) + 1.0j*np.random.random(10)
+        mixed = wQ1_vec(np.concatenate((zi, zo)))
+
+        self.assertTrue( np.array_equal(mixed[10:], wQ1_vec(zo)) )
+        self.assertTrue( np.array_equal(mixed[:10], wQ1_vec(zi)) )
+
+    def test_Backend(self):
+        '''
+        Test that the numpy backend can always be pinned, and that unknown
+        backends are rejected.
+        '''
+        self.assertEqual( w_vec([1.0j], backend='numpy')[0], wQ1(1.0j) )
+        self.assertIn( get_backend(), BACKENDS )
+        self.assertRaises( ValueError, w, 1.0j, backend='fortran' )
+
+    def test_Empty(self):
+        '''
+        Test that empty input gives empty output of the right shape and
+        dtype on every available backend.
+        '''
+        backends = ['numpy'] + ['toms680']*(_toms680 is not None)
+
+        for backend in backends:
+            for z in (np.zeros((0,3), complex), np.zeros(0)):
+                wz, erfz = w_vec(z, backend), erf_vec(z, backend)
+
+                self.assertEqual( (wz.shape, wz.dtype), (z.shape, np.complex128) )
+                self.assertEqual( (erfz.shape, erfz.dtype), (z.shape, z.dtype) )
+
+            self.assertEqual( erf_family([], backend=backend)['erf'].shape, (0,) )
+
+    def test_Workers(self):
+        '''
+        Test that splitting the input over several threads gives the same
+        result as a single thread.
+        '''
+        xr, yr = 6*np.random.random((3,CHUNK))-3, 6*np.random.random((3,CHUNK))-3
+        zr = xr + 1.0j*yr
+        
+        self.assertTrue( np.array_equal(w_vec(zr, workers=4), w_vec(zr)) )
+        self.assertTrue( np.array_equal(erf_vec(zr, workers=4), erf_vec(zr)) )
+    
+    def test_ErfFamily(self):
+        '''
+        Test every member of erf_family against scipy.special, and that
+        erfcx stays finite where exp(z^2) overflows.
+        '''
+        xr, yr = 6*np.random.random(40)-3, 6*np.random.random(40)-3
+        zr = np.concatenate((xr + 1.0j*yr, xr, 1.0j*yr, 1e-3*(xr + 1.0j*yr)))
+
+        res = erf_family(zr)
+        ref = {'erf': special.erf, 'erfc': special.erfc,
+               'erfcx': special.erfcx, 'erfi': special.erfi,
+               'dawson': special.dawsn}
+
+        for name in FAMILY:
+            diff = np.abs(res[name]-ref[name](zr))/np.abs(ref[name](zr))
+            self.assertTrue( np.all(diff<1e-9), name )
+
+        #Single member wrappers, and large arguments
+        zl = np.array([30.0+1.0j, 100.0, 50.0-20.0j])
+        diff = np.abs(erfcx_vec(zl)-special.erfcx(zl))/np.abs(special.erfcx(zl))
+
+        self.assertTrue( np.all(diff<1e-12) )
+        self.assertTrue( np.allclose(erfc_vec(zr), res['erfc'], rtol=1e-14) )
+        self.assertEqual( list(erf_family(zr, ('dawson','erf'))), ['dawson','erf'] )
+
+        #Far left half plane, where exp(-z^2) w(iz) would be 0*inf
+        zn = np.array([-30.0+0.0j, -27.0+0.5j, -8.0-3.0j])
+        left = erf_family(zn, ('erf','erfc'))
+
+        self.assertTrue( np.allclose(left['erf'], special.erf(zn), rtol=1e-12) )
+        self.assertTrue( np.allclose(left['erfc'], special.erfc(zn), rtol=1e-12) )
+
+        #Scalar input keeps its shape, including inside the series region
+        for z0 in (0.1+0.2j, 2.0-1.0j):
+            res0 = erf_family(z0)
+            for name in FAMILY:
+                self.assertEqual( res0[name].shape, () )
+                self.assertTrue( np.isclose(res0[name], ref[name](z0), rtol=1e-12) )
+
+    def test_RealAxis(self):
+        '''
+        Test that real input to erf_vec and w_vec takes the real axis path,
+        agrees with scipy.special and gives real output for erf_vec.
+        '''
+        xr = np.concatenate((12*np.random.random(100)-6, [0.0, 1e-8, -30.0]))
+        
+        erfx, wx = erf_vec(xr), w_vec(xr)
+        
+        self.assertEqual( erfx.dtype, np.float64 )
+        self.assertTrue( np.all(np.abs(erfx-special.erf(xr)) <= 1e-10*np.abs(erfx)) )
+        self.assertTrue( np.all(np.abs(wx-special.wofz(xr)) < 1e-9*np.abs(wx)) )
+        self.assertTrue( np.allclose(w_vec(xr+0j), wx, rtol=1e-14, atol=0) )
+        
+        #Threaded evaluation keeps the real dtype
+        xl = np.random.randn(3*CHUNK)
+        self.assertTrue( np.array_equal(erf_vec(xl, workers=2), erf_vec(xl)) )
+    
+    def test_Voigt(self):
+        '''
+        Test the Voigt profiles against scipy.special.voigt_profile, and
+        their derivatives against central differences.
+        '''
+        x = np.linspace(-5, 5, 101)
+        p = np.array([[-1.0, 0.5, 2.0], [0.3, 1.0, 0.7], [0.2, 0.05, 1e-3]])
+        
+        V, dV = voigt(x, *p, jac=True)
+        ref = special.voigt_profile(x[None,:]-p[0][:,None], p[1][:,None],
+                                    p[2][:,None])
+        
+        self.assertEqual( V.shape, (3,101) )
+        self.assertTrue( np.all(np.abs(V-ref) < 1e-10) )
+        
+        #Central differences in each parameter
+        for j in range(3):
+            dp = np.zeros((3,3))
+            dp[j] = 1e-6
+            fd = (voigt(x, *(p+dp)) - voigt(x, *(p-dp)))/2e-6
+            self.assertTrue( np.all(np.abs(dV[j]-fd) < 1e-6) )
+    
+    def test_FaddeevaTable(self):
+        '''
+        Test that the lookup table agrees with w_vec inside the grid, falls
+        back to w_vec outside of it, and is memory-mapped when reloaded.
+        '''
+        with tempfile.TemporaryDirectory() as folder:
+            
+            path = os.path.join(folder, 'wtable')
+            FaddeevaTable(path, xmax=3.0, ymax=3.0, h=0.1, order=8)
+            table = FaddeevaTable(path, xmax=3.0, ymax=3.0, h=0.1, order=8)
+            
+            self.assertIsInstance( table.values, np.memmap )
+            
+            #Points in every quadrant, inside and outside the table
+            xr, yr = 8*np.random.random(40)-4, 8*np.random.random(40)-4
+            zr = xr + 1.0j*yr
+            inside = np.logical_and(np.abs(xr) <= 3, np.abs(yr) <= 3)
+            
+            wz = w_vec(zr)
+            diff = np.abs(table.w_vec(zr)-wz)
+            
+            self.assertTrue( np.all(diff[inside] < table.error_bound+1e-9) )
+            self.assertTrue( np.all(diff[~inside] <= 1e-12*np.abs(wz[~inside])) )
+            del table
+
+    @unittest.skipIf(_toms680 is None, 'toms680_f2py is not compiled')
+    def test_Toms680Backend(self):
+        '''
+        Test that the compiled TOMS680 backend agrees with the numpy
+        backend in every quadrant.
+        '''
+        xr, yr = 6*np.random.random(40)-3, 6*np.random.random(40)-3
+        zr = np.concatenate((xr + 1.0j*yr, xr, 1.0j*yr, [0.0]))
+
+        wz = w_vec(zr, backend='numpy')
+        diff = np.abs(w_vec(zr, backend='toms680')-wz)/np.abs(wz)
+        diff0 = np.abs(w(zr[0], backend='toms680')-wz[0])/np.abs(wz[0])
+
+        self.assertTrue( np.all(diff<1e-10) )
+        self.assertTrue( diff0<1e-10 )
+
 
 #Run tests if in main namespace
 if __name__ == '__main__':
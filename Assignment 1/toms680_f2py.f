@@ -70,8 +70,8 @@ Cf2py intent(out) FLAG
 *
       XABS = DABS(XI)
       YABS = DABS(YI)
-      X    = XABS/6.3
-      Y    = YABS/4.4
+      X    = XABS/6.3D0
+      Y    = YABS/4.4D0
 *
 C
 C     THE FOLLOWING IF-STATEMENT PROTECTS
@@ -94,16 +94,16 @@ C  USING A POWER-SERIES (ABRAMOWITZ/STEGUN, EQUATION (7.1.5), P.297)
 C  N IS THE MINIMUM NUMBER OF TERMS NEEDED TO OBTAIN THE REQUIRED
 C  ACCURACY
 C
-        QRHO  = (1-0.85*Y)*DSQRT(QRHO)
+        QRHO  = (1-0.85D0*Y)*DSQRT(QRHO)
         N     = IDNINT(6 + 72*QRHO)
         J     = 2*N+1
-        XSUM  = 1.0/J
+        XSUM  = 1.0D0/J
         YSUM  = 0.0D0
         DO 10 I=N, 1, -1
           J    = J - 2
           XAUX = (XSUM*XQUAD - YSUM*YQUAD)/I
           YSUM = (XSUM*YQUAD + YSUM*XQUAD)/I
-          XSUM = XAUX + 1.0/J
+          XSUM = XAUX + 1.0D0/J
  10     CONTINUE
         U1   = -FACTOR*(XSUM*YABS + YSUM*XABS) + 1.0
         V1   =  FACTOR*(XSUM*XABS - YSUM*YABS)
@@ -137,7 +137,7 @@ C
           NU   = IDINT(3 + (1442/(26*QRHO+77)))
         ELSE
           QRHO = (1-Y)*DSQRT(1-QRHO)
-          H    = 1.88*QRHO
+          H    = 1.88D0*QRHO
           H2   = 2*H
           KAPN = IDNINT(7  + 34*QRHO)
           NU   = IDNINT(16 + 26*QRHO)
@@ -217,3 +217,39 @@ C
       RETURN
 *
       END
+*
+*
+*
+      SUBROUTINE WOFZV (N, XI, YI, U, V, IFLAG)
+C
+C  VECTOR DRIVER FOR WOFZ, SO THAT A WHOLE ARRAY OF ARGUMENTS CAN BE
+C  EVALUATED WITH A SINGLE CALL FROM PYTHON.
+C
+C  PARAMETER LIST
+C     N      = NUMBER OF ARGUMENTS
+C     XI     = REAL      PARTS OF Z
+C     YI     = IMAGINARY PARTS OF Z
+C     U      = REAL      PARTS OF W(Z)
+C     V      = IMAGINARY PARTS OF W(Z)
+C     IFLAG  = 1 WHERE WOFZ RAISED ITS OVERFLOW FLAG, 0 OTHERWISE
+C
+      INTEGER N, I
+      DOUBLE PRECISION XI(N), YI(N), U(N), V(N)
+      INTEGER IFLAG(N)
+      LOGICAL FLAG
+Cf2py intent(hide) N
+Cf2py intent(in) XI
+Cf2py intent(in) YI
+Cf2py intent(out) U
+Cf2py intent(out) V
+Cf2py intent(out) IFLAG
+Cf2py threadsafe
+*
+      DO 20 I=1, N
+        CALL WOFZ(XI(I), YI(I), U(I), V(I), FLAG)
+        IFLAG(I) = 0
+        IF (FLAG) IFLAG(I) = 1
+ 20   CONTINUE
+*
+      RETURN
+      END
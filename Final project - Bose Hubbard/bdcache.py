@@ -0,0 +1,385 @@
+"""
+bdcache.py
+@author: Alex Hickey
+
+This module keeps the results of the solver modules (exact_diag, imag_time
+and variational) on disk, so that rerunning or extending a phase diagram only
+computes the points that are missing.
+
+Results are stored in tables, named by a hash of everything the result
+depends on: the solver module, the cutoff N, the tolerances of find_psi and,
+for the phase boundary, the list of hopping amplitudes and the search method.
+A table is a directory of compressed .npz shards with the columns t, mu and
+value. Every write adds a new shard through an atomic rename, so that the
+processes of a pool can write to the same table at the same time, and the
+shards are merged when a table grows. Once the cache is larger than
+max_bytes the least recently used tables are removed.
+"""
+
+#Import modules
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+import uuid
+from functools import partial
+import numpy as np
+
+#Default location and size of the cache
+CACHE_DIR = os.path.join(os.path.expanduser('~'),'.cache','bose_hubbard')
+MAX_BYTES = 256*1024**2
+
+#Number of shards in a table before they are merged into one
+MAX_SHARDS = 32
+
+
+def table_key(module,func,**params):
+    '''
+    Compute the name of the table holding the results of a solver.
+
+    Args:
+        module: Solver module, e.g. exact_diag
+        func: 'bd' or 'find_psi'
+        params: Further parameters the result depends on
+
+    Return:
+        key: Hexadecimal hash
+    '''
+
+    #Tolerances and other defaults of find_psi, overridden by params
+    sig = inspect.signature(module.find_psi).parameters
+    defaults = {k: v.default for k, v in sig.items()
+                if v.default is not inspect.Parameter.empty}
+    defaults.update(params)
+
+    desc = {'module': module.__name__, 'func': func, 'N': int(module.N),
+            'params': sorted((k, repr(v)) for k, v in defaults.items())}
+
+    h = hashlib.sha1(json.dumps(desc,sort_keys=True).encode())
+
+    if func == 'bd':
+        h.update(np.ascontiguousarray(module.tlist,dtype=float).tobytes())
+
+    return h.hexdigest()
+
+
+def load(key,path = CACHE_DIR):
+    '''
+    Read all results stored in a table.
+
+    Args:
+        key: Name of the table, see table_key
+        path: Cache directory
+
+    Return:
+        table: Dictionary mapping (t, mu) to the stored value
+    '''
+
+    table = {}
+    tdir = os.path.join(path,key)
+
+    try:
+        shards = sorted(f for f in os.listdir(tdir) if f.endswith('.npz'))
+    except FileNotFoundError:
+        return table
+
+    for f in shards:
+
+        #Shards may be removed by a concurrent merge, whose output is read
+        #instead (or missed, in which case the points are recomputed)
+        try:
+            with np.load(os.path.join(tdir,f)) as data:
+                table.update(zip(zip(data['t'].tolist(),data['mu'].tolist()),
+                                 data['value'].tolist()))
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            continue
+
+    #Mark the table as recently used
+    try:
+        os.utime(tdir)
+    except FileNotFoundError:
+        pass
+
+    return table
+
+
+def _write_shard(tdir,t,mu,value):
+    '''
+    Write columns to a new shard of a table with an atomic rename.
+
+    Args:
+        tdir: Directory of the table
+        t, mu, value: Columns to write
+
+    Return:
+        name: File name of the shard
+    '''
+
+    os.makedirs(tdir,exist_ok=True)
+
+    #Names sort by time of writing, so that later shards take precedence
+    name = '{:020d}-{}-{}.npz'.format(time.time_ns(),os.getpid(),
+                                      uuid.uuid4().hex[:8])
+    tmp = os.path.join(tdir,'.' + name + '.tmp')
+
+    with open(tmp,'wb') as f:
+        np.savez_compressed(f,t=np.asarray(t,dtype=float),
+                            mu=np.asarray(mu,dtype=float),
+                            value=np.asarray(value,dtype=float))
+
+    os.replace(tmp,os.path.join(tdir,name))
+
+    return name
+
+
+def store(key,t,mu,value,path = CACHE_DIR,max_bytes = MAX_BYTES):
+    '''
+    Add results to a table, merging its shards and evicting old tables as
+    needed.
+
+    Args:
+        key: Name of the table, see table_key
+        t, mu, value: Arrays of hopping amplitudes, chemical potentials and
+                      results
+        path: Cache directory
+        max_bytes: Maximum size of the cache
+    '''
+
+    if len(value) == 0:
+        return
+
+    tdir = os.path.join(path,key)
+    _write_shard(tdir,t,mu,value)
+
+    shards = [f for f in os.listdir(tdir) if f.endswith('.npz')]
+
+    if len(shards) > MAX_SHARDS:
+
+        #Write the merged table before removing the shards it replaces
+        table = load(key,path)
+        (ts, mus), vals = zip(*table.keys()), list(table.values())
+        _write_shard(tdir,ts,mus,vals)
+
+        for f in shards:
+            try:
+                os.remove(os.path.join(tdir,f))
+            except FileNotFoundError:
+                pass
+
+    evict(path,max_bytes,keep=key)
+
+
+def evict(path = CACHE_DIR,max_bytes = MAX_BYTES,keep = None):
+    '''
+    Remove the least recently used tables until the cache fits in max_bytes.
+
+    Args:
+        path: Cache directory
+        max_bytes: Maximum size of the cache
+        keep: Name of a table that is never removed
+
+    Return:
+        size: Size of the cache in bytes after eviction
+    '''
+
+    tables = []
+
+    for key in os.listdir(path):
+
+        tdir = os.path.join(path,key)
+        try:
+            size = sum(e.stat().st_size for e in os.scandir(tdir))
+            tables.append((os.stat(tdir).st_mtime, size, key))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+    total = sum(size for _, size, _ in tables)
+
+    for _, size, key in sorted(tables):
+
+        if total <= max_bytes:
+            break
+
+        if key != keep:
+            shutil.rmtree(os.path.join(path,key),ignore_errors=True)
+            total -= size
+
+    return total
+
+
+def bd(module,mulist,method = 'bisect',map = map,path = CACHE_DIR,
+       max_bytes = MAX_BYTES):
+    '''
+    Compute the phase boundary of a solver module for a list of mu, taking
+    the points already in the cache from disk.
+
+    Args:
+        module: Solver module, e.g. exact_diag
+        mulist: List of chemical potentials
+        method: Search method passed to module.bd
+        map: Function used to map module.bd over the missing mu, e.g. the
+             map method of a multiprocessing.Pool
+        path: Cache directory
+        max_bytes: Maximum size of the cache
+
+    Return:
+        bd_points: Array of critical hopping amplitudes
+    '''
+
+    mulist = np.asarray(mulist,dtype=float)
+    key = table_key(module,'bd',method=method)
+    table = load(key,path)
+
+    #t is not a parameter of bd, and is stored as 0
+    missing = sorted(set(mu for mu in mulist.tolist()
+                         if (0.0, mu) not in table))
+
+    if missing:
+        values = list(map(partial(module.bd,method=method),missing))
+        store(key,np.zeros(len(missing)),missing,values,path,max_bytes)
+        table.update(zip(((0.0, mu) for mu in missing),values))
+
+    return np.array([table[(0.0, mu)] for mu in mulist.tolist()])
+
+
+def find_psi(module,t,mu,path = CACHE_DIR,max_bytes = MAX_BYTES,**kwargs):
+    '''
+    Compute the order parameter of a solver module at a set of points,
+    taking the points already in the cache from disk.
+
+    Args:
+        module: Solver module, e.g. exact_diag
+        t: Hopping amplitudes
+        mu: Chemical potentials, broadcast against t
+        path: Cache directory
+        max_bytes: Maximum size of the cache
+        kwargs: Further arguments of module.find_psi, e.g. tol
+
+    Return:
+        psi: Array of order parameters with the broadcast shape of t and mu
+    '''
+
+    t, mu = np.broadcast_arrays(np.asarray(t,dtype=float),
+                                np.asarray(mu,dtype=float))
+    key = table_key(module,'find_psi',**kwargs)
+    table = load(key,path)
+
+    points = list(zip(t.ravel().tolist(),mu.ravel().tolist()))
+    missing = sorted(set(p for p in points if p not in table))
+
+    if missing:
+        values = [module.find_psi(tm,mm,**kwargs) for tm, mm in missing]
+        ts, mus = zip(*missing)
+        store(key,ts,mus,values,path,max_bytes)
+        table.update(zip(missing,values))
+
+    return np.array([table[p] for p in points]).reshape(t.shape)
+
+
+###############################################################################
+#Testing framework
+
+import unittest
+import tempfile
+from multiprocessing import Pool
+
+class TestBdcache(unittest.TestCase):
+    '''
+    Unit testing class for functions in the bdcache.py module
+    '''
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_bd(self):
+        '''
+        Test that cached boundaries match direct computation, and that a
+        rerun on an extended grid only computes the new points.
+        '''
+
+        import exact_diag
+
+        calls = []
+        def counting_map(f,mus):
+            calls.extend(mus)
+            return [f(mu) for mu in mus]
+
+        mus = np.linspace(0.1,2.9,8)
+        first = bd(exact_diag,mus,'stability',counting_map,self.path)
+        self.assertEqual(len(calls), 8)
+
+        exact = [exact_diag.bd(mu,'stability') for mu in mus]
+        self.assertTrue(np.array_equal(first, exact))
+
+        #Rerun with the grid extended by one point
+        more = np.append(mus,3.0)
+        second = bd(exact_diag,more,'stability',counting_map,self.path)
+        self.assertEqual(len(calls), 9)
+        self.assertTrue(np.array_equal(second[:-1], first))
+
+        #Different method is a different table
+        self.assertNotEqual(table_key(exact_diag,'bd',method='stability'),
+                            table_key(exact_diag,'bd',method='bisect'))
+
+    def test_find_psi(self):
+        '''
+        Test that cached order parameters match direct computation and that
+        the tolerance is part of the key.
+        '''
+
+        import exact_diag
+
+        t = np.array([0.05,0.2])
+        psi = find_psi(exact_diag,t,0.5,path=self.path)
+        self.assertTrue(np.array_equal(psi, [exact_diag.find_psi(x,0.5)
+                                             for x in t]))
+        self.assertNotEqual(table_key(exact_diag,'find_psi'),
+                            table_key(exact_diag,'find_psi',tol=1e-6))
+
+        #Read back from disk without recomputing
+        table = load(table_key(exact_diag,'find_psi'),self.path)
+        self.assertEqual(table[(0.2,0.5)], psi[1])
+
+    def test_concurrent(self):
+        '''
+        Test that processes writing to the same table at once keep every
+        result, including through merges of the shards.
+        '''
+
+        n = 2*MAX_SHARDS + 5
+
+        with Pool(4) as pool:
+            pool.starmap(store,[('k',[0.0],[float(i)],[float(i)],self.path)
+                                for i in range(n)])
+
+        table = load('k',self.path)
+        self.assertEqual(table, {(0.0, float(i)): float(i) for i in range(n)})
+        self.assertTrue(len(os.listdir(os.path.join(self.path,'k')))
+                        <= MAX_SHARDS + 1)
+
+    def test_evict(self):
+        '''
+        Test that the least recently used table is removed first.
+        '''
+
+        for key in ('a','b','c'):
+            store(key,np.zeros(100),np.arange(100.),np.ones(100),self.path)
+            os.utime(os.path.join(self.path,key),(0,0))
+
+        #Read a so that b is the least recently used
+        load('a',self.path)
+        size = sum(e.stat().st_size for e in os.scandir(os.path.join(self.path,'a')))
+        evict(self.path,2*size + 1)
+
+        self.assertEqual(sorted(os.listdir(self.path)), ['a','c'])
+
+
+#Run tests if in main namespace
+if __name__ == '__main__':
+    unittest.main(argv=[''],verbosity=2,exit=False)
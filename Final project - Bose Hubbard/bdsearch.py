@@ -26,13 +26,85 @@ def isSF(psi, tol = 1e-3):
     return np.abs(psi) > tol 
 
 
+def bd_stability(mu,N):
+    '''
+    Calculate the value of t at which the insulator state psi = 0 becomes
+    unstable. To first order in psi the self-consistency map is
+    psi -> t*S*psi, where second order perturbation theory in the hopping
+    term -t*psi*(a + a^dag) gives
+        S = sum_m [<g|a|m><m|a+a^dag|g> + <g|a+a^dag|m><m|a|g>]/(E_m - E_g)
+    over the eigenstates m of the psi = 0 Hamiltonian in the truncated Fock
+    space, with ground state g. The boundary is then t = 1/S.
+    
+    Args:
+        mu: Value of mu
+        N: Maximum number of bosons per site
+        
+    Return:
+        t: Value of t on the phase boundary
+    '''
+    
+    #Spectrum of the psi = 0 Hamiltonian
+    n = np.arange(N+1)
+    E, V = np.linalg.eigh(np.diag(n*(n-1)/2 - mu*n))
+    
+    #Matrix elements of a and a + a^dag between its eigenstates
+    A = V.T @ np.diag(np.sqrt(n[1:]),1) @ V
+    X = A + A.T
+    
+    #Second order sum over excited states
+    num = A[0,1:]*X[1:,0] + X[0,1:]*A[1:,0]
+    dE = E[1:] - E[0]
+    
+    #A degenerate ground state is unstable for any t > 0
+    if np.any(np.logical_and(num != 0, dE < 1e-12)):
+        return 0.0
+    
+    return 1/np.sum(num/dE)
+
+
+def sweep(tlist,mu,solve,N):
+    '''
+    Solve for the ground state along a list of t at fixed mu, starting each
+    solve from the result at the previous t. A solve started from a
+    superfluid state can settle on a spurious superfluid just inside the
+    insulator (and vice versa from psi = 0), so whenever the sweep crosses
+    the boundary given by bd_stability the solve is started from scratch.
+    
+    Args:
+        tlist: List of values of t, in the order of the sweep
+        mu: Value of mu
+        solve: Function called as solve(t,mu,start), where start is the
+               previous result or None for the default initial guess, and
+               returning (result, psi)
+        N: Maximum number of bosons per site
+        
+    Return:
+        psi: Array of order parameters for each t
+    '''
+    
+    tc = bd_stability(mu,N)
+    psi = np.zeros(len(tlist))
+    start = None
+    
+    for i, t in enumerate(tlist):
+        
+        #Cold start when the sweep crosses the boundary
+        if i > 0 and (tlist[i-1] < tc) != (t < tc):
+            start = None
+        
+        start, psi[i] = solve(t,mu,start)
+    
+    return psi
+
+
 def bd(mu,tlist,find_psi):
     '''
     Calculate the value of t required to transition out of an insulator state
-    by recursively halving a provided list.
+    by repeatedly halving a provided list.
     
     Args:
-        tlist: List of values of t to iterate through reursively
+        tlist: List of values of t to iterate through
         mu: Value of mu
         find_psi: Function used to compute the order parameter
         
@@ -40,15 +112,12 @@ def bd(mu,tlist,find_psi):
         t: Value of t on the phase boundary
     '''
     
-    #Return value once list is irreducible
-    if len(tlist) <= 2:
-        
-        return tlist[0]
+    #Index range of the remaining list, halved until it is irreducible
+    lo, hi = 0, len(tlist)
     
-    #Otherwise divide list in half
-    else:
+    while hi - lo > 2:
         
-        indx = len(tlist) // 2
+        indx = lo + (hi - lo) // 2
         t = tlist[indx]
         
         #Compute psi with given function
@@ -57,10 +126,276 @@ def bd(mu,tlist,find_psi):
         #Chosen t corresponds to superfluid
         if isSF(psi):
             
-            return bd(mu,tlist[:indx],find_psi)
+            hi = indx
         
         #Chosen t corresponds to insulator
         else:
             
-            return bd(mu,tlist[indx:],find_psi)
+            lo = indx
+    
+    return tlist[lo]
+
+
+#Methods of find_bd
+BD_METHODS = ('bisect', 'stability')
+
+def find_bd(mu,method,tlist,find_psi,N):
+    '''
+    Find the phase boundary for a given mu with one of the methods shared by
+    the solver modules.
+    
+    Args:
+        mu: Value of mu
+        method: 'bisect' to bisect tlist with find_psi (see bd), or
+                'stability' to solve for the instability of the insulator
+                directly (see bd_stability)
+        tlist: List of values of t to bisect
+        find_psi: Function used to compute the order parameter
+        N: Maximum number of bosons per site
+        
+    Return:
+        t: Value of t on the phase boundary
+    '''
+    
+    if method == 'bisect':
+        return bd(mu,tlist,find_psi)
+    elif method == 'stability':
+        return bd_stability(mu,N)
+    
+    raise ValueError('Unknown method {}, expected one of {}'
+                     .format(method,BD_METHODS))
+
+
+def bd_bracket(mu,find_psi,lo,hi,tol = 1e-6,tmin = 0.001,tmax = 0.2):
+    '''
+    Calculate the value of t on the phase boundary to a tolerance tol on a
+    continuous interval, starting from a guess [lo, hi] for the bracket.
+    The bracket is first widened until lo is an insulator and hi a
+    superfluid, and then shrunk. Since psi^2 is a smooth function of t that
+    vanishes at t_c on the superfluid side, the zero of the polynomial
+    through the last (up to three) superfluid points is probed on either
+    side whenever it falls inside the bracket, and the bracket is halved
+    otherwise.
+    
+    The probes land within tol of t_c, where a plain fixed-point iteration
+    for psi converges critically slowly (exact_diag.find_psi with accel =
+    None runs into max_it there), so find_psi should use an accelerated or
+    bracketed solve, e.g. exact_diag.find_psi with accel = 'brent'.
+    
+    Args:
+        mu: Value of mu
+        find_psi: Function used to compute the order parameter, see above
+        lo, hi: Initial guess for the bracket
+        tol: Tolerance on the boundary
+        tmin, tmax: Range of t to search, tmin (tmax) is returned if the
+                    boundary lies below (above) it
+        
+    Return:
+        t: Value of t on the phase boundary
+    '''
+    
+    lo, hi = max(lo,tmin), min(hi,tmax)
+    width = max(hi - lo, tol)
+    
+    #Superfluid points, used to extrapolate psi^2 to zero
+    sf = []
+    
+    #Widen the bracket downwards until lo is an insulator
+    psi = find_psi(lo,mu)
+    
+    while isSF(psi):
+        
+        sf.append((lo,psi))
+        if lo <= tmin:
+            return tmin
+        
+        hi, width = lo, 2*width
+        lo = max(lo - width, tmin)
+        psi = find_psi(lo,mu)
+    
+    #Widen the bracket upwards until hi is a superfluid
+    if not sf or sf[-1][0] != hi:
+        
+        psi = find_psi(hi,mu)
+        
+        while not isSF(psi):
+            
+            if hi >= tmax:
+                return tmax
+            
+            lo, width = hi, 2*width
+            hi = min(hi + width, tmax)
+            psi = find_psi(hi,mu)
+        
+        sf.append((hi,psi))
+    
+    #Shrink the bracket
+    while hi - lo > tol:
+        
+        t = 0.5*(lo + hi)
+        t_est = _psi2_zero(sf[-3:],lo,hi)
+        
+        #Probe just below the estimate, then just above it
+        if t_est is not None:
+            
+            if lo + tol/4 < t_est - tol/4 < hi:
+                t = t_est - tol/4
+            elif lo < t_est + tol/4 < hi - tol/4:
+                t = t_est + tol/4
+        
+        psi = find_psi(t,mu)
+        
+        if isSF(psi):
+            
+            hi = t
+            sf.append((t,psi))
+        
+        else:
+            
+            lo = t
+    
+    return lo
+
+
+def _psi2_zero(sf,lo,hi):
+    '''
+    Estimate where psi^2 vanishes from a few superfluid points.
+    
+    Args:
+        sf: List of two or three (t, psi) superfluid points
+        lo, hi: Bracket the estimate has to fall into
+        
+    Return:
+        t: Zero of the interpolating polynomial of psi^2 in [lo, hi], or
+           None if there is none
+    '''
+    
+    t = np.array([p[0] for p in sf])
+    psi2 = np.array([p[1] for p in sf])**2
+    
+    if len(sf) < 2 or len(np.unique(t)) < len(t):
+        return None
+    
+    #Polynomial in t - lo, for conditioning
+    roots = np.roots(np.polyfit(t - lo, psi2, len(sf)-1)) + lo
+    roots = roots[np.isreal(roots)].real
+    roots = roots[np.logical_and(roots > lo, roots < hi)]
+    
+    if len(roots) == 0:
+        return None
+    
+    #Closest root to the superfluid points
+    return roots[np.argmax(roots)]
+
+
+def trace(mulist,find_psi,tol = 1e-6,tmin = 0.001,tmax = 0.2):
+    '''
+    Trace the phase boundary t_c(mu) along a list of mu with a
+    predictor-corrector scheme. The boundary at each mu is predicted by
+    extrapolation from the previous (up to three) points, and corrected with
+    bd_bracket from a bracket around the prediction twice as wide as the
+    previous prediction error. Near the tips and cusps of the Mott lobes,
+    where the prediction is poor, bd_bracket widens the bracket again.
+    As for bd_bracket, find_psi has to stay fast right at the boundary, see
+    exact_diag.trace for a tracer with an accelerated solve.
+    
+    Args:
+        mulist: Increasing array of mu
+        find_psi: Function used to compute the order parameter, with an
+                  accelerated solve (see bd_bracket)
+        tol: Tolerance on the boundary
+        tmin, tmax: Range of t to search
+        
+    Return:
+        tc: Array of t on the phase boundary for each mu
+    '''
+    
+    tc = np.zeros(len(mulist))
+    
+    for i, mu in enumerate(mulist):
+        
+        #No prediction for the first point
+        if i == 0:
+            
+            tc[i] = bd_bracket(mu,find_psi,tmin,tmax,tol,tmin,tmax)
+            continue
+        
+        #Predictor, polynomial through the previous (up to three) points
+        if i == 1:
+            delta = 0.01
+        k = min(i,3)
+        t_pred = np.polyval(np.polyfit(mulist[i-k:i],tc[i-k:i],k-1),mu)
+        
+        #Corrector
+        tc[i] = bd_bracket(mu,find_psi,t_pred-delta,t_pred+delta,tol,tmin,tmax)
+        delta = max(2*np.abs(tc[i] - t_pred), 4*tol)
+    
+    return tc
+
+
+def refine(bd,mu_min = 0.001,mu_max = 3.0,tol = 1e-3,n0 = 13,
+           min_width = 1e-4,max_evals = 1000,map = map):
+    '''
+    Sample the phase boundary t_c(mu) adaptively. Starting from a uniform
+    grid of n0 points, intervals are split at their midpoint until the error
+    of linear interpolation is estimated to be below tol everywhere. The
+    error of an interval of width h is estimated as h/4 times the sum of the
+    changes of slope at its ends. Where the boundary is smooth this is
+    h^2 f''/2, and for a kink inside the interval, as at the cusps of the
+    Mott lobes, the two ends share the change of slope, so that the sum
+    bounds the error h*(change of slope)/4. Points then collect at the tips
+    and cusps while the flat parts are left coarse. If min_width or
+    max_evals stops the refinement before tol is reached, a message is
+    printed.
+    
+    Args:
+        bd: Function of mu returning t on the phase boundary
+        mu_min, mu_max: Range of mu
+        tol: Tolerance on the linear interpolation of the boundary
+        n0: Number of points in the initial grid
+        min_width: Intervals narrower than this are not split, which bounds
+                   the refinement where bd is discontinuous or, as for
+                   bisection on a list of t, only accurate to its spacing
+        max_evals: Maximum number of calls to bd, the intervals with the
+                   largest error are split first once this is reached
+        map: Function used to map bd over the midpoints of each round, e.g.
+             the map method of a multiprocessing.Pool
+        
+    Return:
+        mu: Sorted array of mu
+        tc: Array of t on the phase boundary for each mu
+    '''
+    
+    mu = np.linspace(mu_min,mu_max,n0)
+    tc = np.array(list(map(bd,mu)))
+    
+    while True:
+        
+        #Change of slope at each point, zero at the ends of the range
+        h = np.diff(mu)
+        ds = np.zeros(len(mu))
+        ds[1:-1] = np.abs(np.diff(np.diff(tc)/h))
+        
+        #Estimated error of each interval
+        err = h/4*(ds[:-1] + ds[1:])
+        
+        split = np.flatnonzero(np.logical_and(err > tol, h/2 > min_width))
+        if len(split) == 0 or len(mu) >= max_evals:
+            break
+        
+        #Largest errors first if the budget runs out
+        split = split[np.argsort(-err[split])][:max_evals - len(mu)]
+        
+        mids = (mu[split] + mu[split+1])/2
+        new = np.array(list(map(bd,mids)))
+        
+        order = np.argsort(np.concatenate((mu,mids)),kind='stable')
+        mu = np.concatenate((mu,mids))[order]
+        tc = np.concatenate((tc,new))[order]
+    
+    if np.any(err > tol):
+        print('Refinement stopped by '
+              +('max_evals' if len(split) else 'min_width')
+              +' with estimated error '+str(np.max(err))+' above tol')
     
+    return mu, tc
@@ -10,12 +10,19 @@ are in units of the on-site interaction energy.
 """
 
 #Import modules
+from functools import lru_cache
 import numpy as np
+import scipy.linalg
+import scipy.optimize
 import bdsearch
 
 #Set maximum number of bosons per site
 N = 10
 
+#Cutoff from which find_psi uses the tridiagonal solver by default, below
+#it the dense eigh of the small matrix is faster
+TRIDIAG_MIN_N = 24
+
 
 def construct_hamiltonian(psi,t,mu):
     '''
@@ -63,6 +70,54 @@ def groundstate(H):
     return eigvals[0], eigvecs[:,0]
 
 
+@lru_cache(maxsize=1024)
+def static_diagonal(mu,N):
+    '''
+    Diagonal of the MF Hamiltonian without the t*psi^2 shift, which only
+    depends on mu and the cutoff and is cached between calls.
+    
+    Args:
+        mu: Chemical potential
+        N: Maximum number of bosons per site
+        
+    Return:
+        diag: Read-only array of n(n-1)/2 - mu n for n = 0, ..., N
+    '''
+    
+    n = np.arange(N+1)
+    diag = n*(n-1)/2 - mu*n
+    diag.flags.writeable = False
+    
+    return diag
+
+
+def groundstate_tridiagonal(psi,t,mu):
+    '''
+    Calculate the lowest eigenpair of the MF Hamiltonian from its diagonal
+    and off-diagonal only, without forming the matrix or the rest of the
+    spectrum.
+    
+    Args:
+        psi: Superfluid order parameter
+        t: Hopping amplitude
+        mu: Chemical potential
+        
+    Return:
+        E0: Lowest eigenvalue
+        state: Corresponding eigenvector
+    '''
+    
+    diag = static_diagonal(mu,N) + t*psi*psi
+    offdiag = -t*psi*np.sqrt(np.arange(1,N+1))
+    
+    eigvals, eigvecs = scipy.linalg.eigh_tridiagonal(diag, offdiag,
+                                                     select='i',
+                                                     select_range=(0,0),
+                                                     check_finite=False)
+    
+    return eigvals[0], eigvecs[:,0]
+
+
 def compute_psi(state):
     '''
     Compute the superfluid order parameter <a> for a given state.
@@ -74,66 +129,342 @@ def compute_psi(state):
         psi: Superfluid order parameter
     '''
     
-    return np.sum([state[j]*state[j+1]*np.sqrt(j+1) for j in range(N)])
+    return np.sum(state[:-1]*state[1:]*np.sqrt(np.arange(1,N+1)))
     
 
 
-def find_psi(t,mu,tol = 1e-13):
+def find_psi(t,mu,tol = 1e-13,solver = None,accel = None,max_it = 100000,
+             return_count = False,psi0 = 1e-3):
     '''
     Find the value of the superfluid order parameter by iterating the
     exact-diaganilization process.
+    
+    Near the phase boundary the map psi -> F(psi) contracts ever more slowly,
+    so the plain iteration can be replaced by
+        'aitken': Steffensen's method, which extrapolates every pair of
+                  iterates with Aitken's delta-squared formula
+        'brent': Bracketed root solve of F(psi) - psi = 0 on psi > 0, where
+                 a positive root exists only in the superfluid phase
 
     Args:
         t: Hopping amplitude
         mu: Chemical potential
         tol: Tolerance for convergence
+        solver: 'dense' or 'tridiagonal', by default the tridiagonal solver
+                is used when N >= TRIDIAG_MIN_N
+        accel: None for plain fixed-point iteration, 'aitken' or 'brent'
+        max_it: Maximum number of ground state evaluations
+        return_count: If True, also return the number of evaluations
+        psi0: Initial guess for psi (not used by 'brent')
         
     Return:
         psi: Superfluid order parameter
+        count: Number of ground state evaluations (if return_count)
     '''
     
+    #Pick ground state solver
+    if solver is None:
+        solver = 'tridiagonal' if N >= TRIDIAG_MIN_N else 'dense'
     
-    #Initial guess for psi
-    psi0 = 1e-3
+    if solver == 'dense':
+        gnd = lambda psi: groundstate(construct_hamiltonian(psi,t,mu))
+    elif solver == 'tridiagonal':
+        gnd = lambda psi: groundstate_tridiagonal(psi,t,mu)
+    else:
+        raise ValueError('Unknown solver '+str(solver))
+    
+    #Self-consistency map
+    F = lambda psi: compute_psi(gnd(psi)[1])
+    
+    if accel is None:
+        psi, cnt = _fixed_point(F,tol,max_it,psi0)
+    elif accel == 'aitken':
+        psi, cnt = _steffensen(F,tol,max_it,psi0)
+    elif accel == 'brent':
+        psi, cnt = _bracketed(F,tol,max_it)
+    else:
+        raise ValueError('Unknown accelerator '+str(accel))
     
-    #Compute ground state given initial guess
-    E, state = groundstate(construct_hamiltonian(psi0,t,mu))
+    if cnt >= max_it:
+        print('Did not converge after '+str(max_it)+' iterations')
     
-    #Update psi
-    psi = compute_psi(state)
+    if return_count:
+        return psi, cnt
+    
+    return psi
+
+
+def _fixed_point(F,tol,max_it,psi0 = 1e-3):
+    '''
+    Plain fixed-point iteration psi -> F(psi).
+    
+    Args:
+        F: Self-consistency map
+        tol: Tolerance on consecutive iterates
+        max_it: Maximum number of evaluations of F
+        psi0: Initial guess for psi
+        
+    Return:
+        psi: Superfluid order parameter
+        cnt: Number of evaluations of F
+    '''
+    
+    psi = F(psi0)
+    cnt = 1
     
     #Iterate through process until self-consistent
-    while np.abs(psi - psi0) > tol:
+    while np.abs(psi - psi0) > tol and cnt < max_it:
 
         #Update psi
         psi0 = psi
+        psi = F(psi0)
+        cnt += 1
+        
+    return psi, cnt
+
+
+def _steffensen(F,tol,max_it,psi0 = 1e-3):
+    '''
+    Fixed-point iteration accelerated with Aitken's delta-squared
+    extrapolation after every two steps. Since psi = 0 is always a fixed
+    point, extrapolations that would reverse the direction in which the
+    iterates move are rejected, so that a sequence growing away from the
+    unstable psi = 0 is not sent back to it.
+    
+    Args:
+        F: Self-consistency map
+        tol: Tolerance on consecutive iterates
+        max_it: Maximum number of evaluations of F
+        psi0: Initial guess for psi
+        
+    Return:
+        psi: Superfluid order parameter
+        cnt: Number of evaluations of F
+    '''
+    
+    cnt = 0
+    
+    while cnt < max_it:
         
-        #Compute updated ground state
-        E, state = groundstate(construct_hamiltonian(psi0,t,mu))
+        #Two plain steps
+        psi1 = F(psi0)
+        cnt += 1
+        if np.abs(psi1 - psi0) <= tol:
+            return psi1, cnt
         
-        #Compute psi for new state
-        psi = compute_psi(state)
+        psi2 = F(psi1)
+        cnt += 1
+        if np.abs(psi2 - psi1) <= tol:
+            return psi2, cnt
         
-    return psi
+        #Aitken extrapolation, kept only if it continues in the direction
+        #of the last step
+        denom = psi2 - 2*psi1 + psi0
+        psi0 = psi2
+        
+        if denom != 0:
+            
+            psi_acc = psi0 - (psi2 - psi1)**2/denom
+            
+            if np.isfinite(psi_acc) and (psi_acc-psi2)*(psi2-psi1) > 0:
+                psi0 = psi_acc
+    
+    return psi0, cnt
+
+
+def _bracketed(F,tol,max_it):
+    '''
+    Solve F(psi) = psi for the superfluid root with Brent's method. The
+    root is bracketed by a small psi, where F(psi) - psi > 0 only if psi = 0
+    is unstable, and by sqrt(N)+1, which exceeds any <a> in the truncated
+    space. If psi = 0 is stable the Mott value psi = 0 is returned.
+    
+    Args:
+        F: Self-consistency map
+        tol: Absolute tolerance on psi
+        max_it: Maximum number of evaluations of F
+        
+    Return:
+        psi: Superfluid order parameter
+        cnt: Number of evaluations of F
+    '''
+    
+    g = lambda psi: F(psi) - psi
+    
+    #Stability of the Mott solution
+    lo, hi = 1e-8, np.sqrt(N)+1
+    if g(lo) <= 0:
+        return 0.0, 1
+    
+    psi, res = scipy.optimize.brentq(g, lo, hi, xtol=tol, maxiter=max_it,
+                                     full_output=True, disp=False)
+    
+    return psi, res.function_calls + 1
+
+def construct_hamiltonians(psi,t,mu):
+    '''
+    Construct a stack of MF Hamiltonians in the occupation number basis, one
+    for each element of the (flat) parameter arrays.
+    
+    Args:
+        psi: Array of B superfluid order parameters
+        t: Array of B hopping amplitudes
+        mu: Array of B chemical potentials
+        
+    Return:
+        H: (B,N+1,N+1) array of mean field Hamiltonian matrices
+    '''
+    
+    n = np.arange(N+1)
+    tpsi = (t*psi)[:,None]
+    
+    H = np.zeros((len(psi), N+1, N+1))
+    
+    #Diagonal components
+    H[:,n,n] = n*(n-1)/2 - mu[:,None]*n + tpsi*psi[:,None]
+    
+    #Off-diagonal components
+    H[:,n[:-1],n[1:]] = -tpsi*np.sqrt(n[1:])
+    H[:,n[1:],n[:-1]] = H[:,n[:-1],n[1:]]
+    
+    return H
+
+
+def find_psi_batch(t,mu,tol = 1e-13,max_it = 100000):
+    '''
+    Find the superfluid order parameter at many points of parameter space at
+    once. Every iteration diagonalizes the stacked Hamiltonians of all
+    points that have not converged yet in a single call to eigh, and each
+    point drops out of the batch as soon as it is self-consistent, so the
+    result at each point is the same as from find_psi.
+
+    Args:
+        t: Array of hopping amplitudes
+        mu: Array of chemical potentials, broadcast against t
+        tol: Tolerance for convergence
+        max_it: Maximum number of iterations
+        
+    Return:
+        psi: Array of superfluid order parameters, with the broadcast shape
+             of t and mu
+    '''
+    
+    #Flat parameter arrays
+    t, mu = np.broadcast_arrays(np.asarray(t,dtype=float),
+                                np.asarray(mu,dtype=float))
+    shape = t.shape
+    t, mu = t.ravel(), mu.ravel()
+    
+    #Initial guess for psi
+    psi0 = np.full(t.shape, 1e-3)
+    psi = _psi_batch(psi0,t,mu)
+    
+    #Points that are not self-consistent yet
+    active = np.flatnonzero(np.abs(psi - psi0) > tol)
+    cnt = 1
+    
+    while active.size > 0 and cnt < max_it:
+        
+        #Update psi on the active points only
+        psi0[active] = psi[active]
+        psi[active] = _psi_batch(psi0[active],t[active],mu[active])
+        cnt += 1
+        
+        active = active[np.abs(psi[active] - psi0[active]) > tol]
+    
+    if active.size > 0:
+        print(str(active.size)+' points did not converge after '
+              +str(max_it)+' iterations')
+        
+    return psi.reshape(shape)
+
+
+def _psi_batch(psi,t,mu):
+    '''
+    One exact-diagonalization step for a batch of points.
+    
+    Args:
+        psi: Array of B superfluid order parameters
+        t: Array of B hopping amplitudes
+        mu: Array of B chemical potentials
+        
+    Return:
+        psi: Array of B updated order parameters
+    '''
+    
+    #Ground states of every Hamiltonian in the stack
+    eigvals, eigvecs = np.linalg.eigh(construct_hamiltonians(psi,t,mu))
+    states = eigvecs[:,:,0]
+    
+    return np.sum(states[:,:-1]*states[:,1:]*np.sqrt(np.arange(1,N+1)),
+                  axis=1)
+
+
+def sweep(tlist,mu,tol = 1e-13,**kwargs):
+    '''
+    Compute the order parameter along a list of t at fixed mu, starting
+    each self-consistent solve from the psi of the previous point (see
+    bdsearch.sweep).
+    
+    Args:
+        tlist: List of hopping amplitudes, in the order of the sweep
+        mu: Chemical potential
+        tol: Tolerance for convergence
+        kwargs: Further arguments of find_psi
+        
+    Return:
+        psi: Array of order parameters
+    '''
+    
+    def solve(t,mu,start):
+        psi = find_psi(t,mu,tol,psi0=1e-3 if start is None else start,
+                       **kwargs)
+        return psi, psi
+    
+    return bdsearch.sweep(tlist,mu,solve,N)
+
 
 #List of hopping amplitudes to iterate over
 tlist = np.linspace(0.001,0.2,999)
 
-def bd(mu):
+def bd(mu,method = 'bisect'):
     '''
     Search for the phase boundary for a given mu, by iterating throught
     hopping amplitudes.
     
     Args:
         mu: Chemical potential
+        method: 'bisect' to bisect tlist with find_psi, or 'stability' to
+                solve for the instability of the insulator directly (see
+                bdsearch.bd_stability), which is not limited to tlist
         
     Return:
         bd_point: Critical hopping amplitude
         
     '''
     
+    return bdsearch.find_bd(mu,method,tlist,find_psi,N)
+
+
+def trace(mulist,tol = 1e-6,accel = 'brent',**kwargs):
+    '''
+    Trace the phase boundary along a list of mu (see bdsearch.trace). The
+    tracer probes t within tol of the boundary, where the plain fixed-point
+    iteration slows down critically, so find_psi is accelerated by default.
+    
+    Args:
+        mulist: Increasing array of mu
+        tol: Tolerance on the boundary
+        accel: Accelerator passed to find_psi, 'brent' or 'aitken'
+        kwargs: Further arguments of bdsearch.trace, e.g. tmin and tmax
+        
+    Return:
+        tc: Array of t on the phase boundary for each mu
+    '''
     
-    return bdsearch.bd(mu,tlist,find_psi)
+    find = lambda t,mu: find_psi(t,mu,accel=accel)
+    
+    return bdsearch.trace(mulist,find,tol,**kwargs)
 
     
 ###############################################################################
@@ -163,6 +494,146 @@ class TestExactDiag(unittest.TestCase):
         
         self.assertTrue(np.abs(psi) < tol) 
     
+    def test_tridiagonal(self):
+        '''
+        Test that the tridiagonal solver reproduces the dense one, in both
+        phases.
+        '''
+        
+        for t, mu in [(0.05,0.5),(0.2,0.5),(0.15,1.7)]:
+            
+            H = construct_hamiltonian(0.3,t,mu)
+            E, state = groundstate(H)
+            E_tri, state_tri = groundstate_tridiagonal(0.3,t,mu)
+            
+            self.assertTrue(np.abs(E-E_tri) < 1e-12)
+            self.assertTrue(np.abs(np.abs(state@state_tri)-1) < 1e-12)
+            self.assertTrue(np.abs(find_psi(t,mu)
+                                   - find_psi(t,mu,solver='tridiagonal')) < 1e-10)
+        
+        self.assertIs(static_diagonal(0.5,N), static_diagonal(0.5,N))
+    
+    def test_accelerated(self):
+        '''
+        Test that the accelerated solvers agree with the plain iteration
+        close to the phase boundary at (t=0.1,mu=1.5), with fewer ground
+        state evaluations, and that the iteration count is capped.
+        '''
+        
+        for t in [0.098,0.102]:
+            
+            psi, cnt = find_psi(t,1.5,return_count=True)
+            
+            for accel in ['aitken','brent']:
+                
+                psi_acc, cnt_acc = find_psi(t,1.5,accel=accel,
+                                            return_count=True)
+                
+                self.assertTrue(np.abs(psi_acc - psi) < 1e-9)
+                self.assertTrue(cnt_acc < cnt/3)
+        
+        psi, cnt = find_psi(0.1,1.5,max_it=50,return_count=True)
+        self.assertEqual(cnt, 50)
+    
+    def test_stability(self):
+        '''
+        Test the linear stability boundary against the analytic mean field
+        result and against bisection of tlist.
+        '''
+        
+        for mu in [0.3,1.3,2.6]:
+            
+            #Lobe with n bosons, far from the cutoff
+            n = np.ceil(mu)
+            exact = 1/((n+1)/(n-mu) + n/(mu-n+1))
+            
+            self.assertTrue(np.abs(bd(mu,method='stability') - exact) < 1e-12)
+            self.assertTrue(0 <= exact - bd(mu) <= 2*(tlist[1]-tlist[0]))
+        
+        self.assertEqual(bd(1.0,method='stability'), 0.0)
+        
+        with self.assertRaises(ValueError):
+            bd(0.5,method='stabilty')
+    
+    def test_trace(self):
+        '''
+        Test that tracing the boundary along mu reaches the requested
+        tolerance with a few calls to find_psi per point, within a lobe and
+        across the cusps at integer mu.
+        '''
+        
+        calls = []
+        def find(t,mu):
+            calls.append(t)
+            return find_psi(t,mu,accel='brent')
+        
+        for mulist, max_calls in [(np.linspace(0.05,0.95,40),8),
+                                  (np.linspace(0.5,2.5,41),12)]:
+            
+            del calls[:]
+            tc = bdsearch.trace(mulist,find,tol=1e-6)
+            
+            #Boundary below tmin at the cusps is returned as tmin
+            exact = np.array([bd(mu,method='stability') for mu in mulist])
+            exact = np.maximum(exact,0.001)
+            
+            self.assertTrue(np.all(np.abs(tc - exact) < 2e-6))
+            self.assertTrue(len(calls) < max_calls*len(mulist))
+        
+        #Accelerated by default
+        self.assertTrue(np.array_equal(trace(mulist),tc))
+    
+    def test_refine(self):
+        '''
+        Test that adaptive sampling of the boundary reaches the requested
+        tolerance, including at the cusps, which a uniform grid with four
+        times as many points does not.
+        '''
+        
+        def exact(mu):
+            n = np.ceil(mu)
+            return np.where(mu == n,0,(n-mu)*(mu-n+1)/(mu+1))
+        
+        mus = np.linspace(0.001,3.0,100001)
+        tol = 1e-4
+        
+        mu, tc = bdsearch.refine(lambda m: bd(m,method='stability'),tol=tol)
+        uniform = np.linspace(0.001,3.0,4*len(mu))
+        
+        err = np.abs(np.interp(mus,mu,tc) - exact(mus))
+        err_uniform = np.abs(np.interp(mus,uniform,exact(uniform)) - exact(mus))
+        
+        self.assertTrue(np.max(err) < tol)
+        self.assertTrue(np.max(err_uniform) > tol)
+    
+    def test_sweep(self):
+        '''
+        Test that a warm-started sweep across the boundary at mu=0.5
+        reproduces independent solves, in both directions.
+        '''
+        
+        ts = np.linspace(0.1,0.3,9)
+        cold = np.array([find_psi(t,0.5) for t in ts])
+        
+        self.assertTrue(np.all(np.abs(sweep(ts,0.5) - cold) < 1e-9))
+        self.assertTrue(np.all(np.abs(sweep(ts[::-1],0.5) - cold[::-1]) < 1e-9))
+    
+    def test_batch(self):
+        '''
+        Test that the batched solver agrees with find_psi on a small grid
+        covering both phases.
+        '''
+        
+        tgrid, mugrid = np.array([0.02,0.06,0.14,0.2]), np.array([0.3,1.5,2.5])
+        psi = find_psi_batch(tgrid[None,:],mugrid[:,None])
+        
+        self.assertEqual(psi.shape, (3,4))
+        
+        for i in range(3):
+            for j in range(4):
+                self.assertTrue(np.abs(psi[i,j]
+                                       - find_psi(tgrid[j],mugrid[i])) < 1e-10)
+    
 
 #Run tests if in main namespace
 if __name__ == '__main__':
@@ -10,6 +10,7 @@ these parameters are in units of the on-site interaction energy.
 
 #Import modules
 import numpy as np
+import scipy.linalg
 import bdsearch
 
 #Fix maximum number of bosons per site
@@ -104,51 +105,206 @@ def RK5step(y,psi,t,mu,h=.07):
     Return:
         newstate: Array of coefficients after taking a timestep h
     '''
+    
+    y5, y4 = _fehlberg(y,lambda state: H(state,psi,t,mu),h)
+    
+    #Result must be re-normalized!
+    return y5/np.linalg.norm(y5)
+
+
+def _fehlberg(y,Hop,h):
+    '''
+    Compute the 5th and embedded 4th order Runge-Kutta-Fehlberg steps of
+    dy/dtau = -Hop(y).
+    
+    Args:
+        y: Array of coefficients in the occupation number basis
+        Hop: Function acting with the Hamiltonian on a state
+        h: Time step
         
+    Return:
+        y5: 5th order step, not normalized
+        y4: 4th order step, not normalized
+    '''
+    
     #Compute RK5 coefficients        
-    k1 = -h*H(y,psi,t,mu)
-    k2 = -h*H(y+k1/4.0,psi,t,mu)
-    k3 = -h*H(y+(3/32)*k1+(9/32)*k2,psi,t,mu)
-    k4 = -h*H(y+(1932/2197)*k1-(7200/2197)*k2+(7296/2197)*k3,psi,t,mu)
-    k5 = -h*H(y+(439/216)*k1-8*k2+(3680/513)*k3-(845/4104)*k4,psi,t,mu)
-    k6 = -h*H(y-(8/27)*k1+2*k2-(3544/2565)*k3+(1859/4104)*k4-(11/40)*k5,psi,t,mu)
+    k1 = -h*Hop(y)
+    k2 = -h*Hop(y+k1/4.0)
+    k3 = -h*Hop(y+(3/32)*k1+(9/32)*k2)
+    k4 = -h*Hop(y+(1932/2197)*k1-(7200/2197)*k2+(7296/2197)*k3)
+    k5 = -h*Hop(y+(439/216)*k1-8*k2+(3680/513)*k3-(845/4104)*k4)
+    k6 = -h*Hop(y-(8/27)*k1+2*k2-(3544/2565)*k3+(1859/4104)*k4-(11/40)*k5)
     
     #Take timestep
     y5 = y+(16/135)*k1+(6656/12825)*k3+(28561/56430)*k4-(9/50)*k5+(2/55)*k6
+    y4 = y+(25/216)*k1+(1408/2565)*k3+(2197/4104)*k4-(1/5)*k5
+    
+    return y5, y4
+
+
+def RKF45step(y,psi,t,mu,h=.07):
+    '''
+    Takes the same step forward as RK5step, and estimates its error from the
+    embedded 4th order step. Both steps are normalized before they are
+    compared, so that the error measures the change of direction of the
+    state rather than the overall decay of its norm.
+    
+    Args:
+        y: Normalized array of coefficients in the occupation number basis
+        psi: Superfluid order parameter
+        t: Hopping amplitude
+        mu: Chemical potential
+        h: Time step
+        
+    Return:
+        newstate: Array of coefficients after taking a timestep h
+        err: Estimated error of newstate
+    '''
+    
+    y5, y4 = _fehlberg(y,lambda state: H(state,psi,t,mu),h)
+    y5, y4 = y5/np.linalg.norm(y5), y4/np.linalg.norm(y4)
+    
+    return y5, np.linalg.norm(y5-y4)
+
+
+class RKF45Stepper:
+    '''
+    Adaptive time stepper for find_gnd. The step size is kept between calls,
+    and after each attempt scaled by 0.9*(atol/err)^(1/5), within a factor
+    of 5 either way, so that it grows while the state changes smoothly and
+    shrinks only when a step is rejected for an error above atol.
+    '''
+    
+    def __init__(self,h = .07,atol = 1e-7,h_min = 1e-6):
+        
+        self.h = h
+        self.h_used = h
+        self.atol = atol
+        self.h_min = h_min
+        self.accepted = 0
+        self.rejected = 0
+    
+    def __call__(self,y,psi,t,mu):
+        '''
+        Take one accepted step, with the same arguments as RK5step.
+        '''
+        
+        while True:
+            
+            self.h_used = self.h
+            newstate, err = RKF45step(y,psi,t,mu,self.h)
+            accept = err <= self.atol or self.h <= self.h_min
+            
+            #Scale the step for the next attempt
+            fac = 0.9*(self.atol/max(err,1e-300))**0.2
+            self.h = max(self.h*min(5.0,max(0.2,fac)),self.h_min)
+            
+            if accept:
+                self.accepted += 1
+                return newstate
+            
+            self.rejected += 1
+    
+    def stats(self):
+        '''
+        Return:
+            stats: Dictionary of step statistics, with 6 applications of H
+                   per attempted step
+        '''
+        
+        return {'accepted': self.accepted, 'rejected': self.rejected,
+                'h': self.h, 'H_evals': 6*(self.accepted + self.rejected)}
+
+
+def expstep(y,psi,t,mu,tau_gap = 5.0):
+    '''
+    Takes an exact step forward in imaginary time, y -> exp(-tau H) y, 
+    through the eigendecomposition of the tridiagonal Hamiltonian. The step
+    tau = tau_gap/gap is chosen so that every excited state is damped by at
+    least a factor exp(-tau_gap) relative to the ground state.
+    
+    Args:
+        y: Array of coefficients in the occupation number basis
+        psi: Superfluid order parameter
+        t: Hopping amplitude
+        mu: Chemical potential
+        tau_gap: Time step in units of the inverse spectral gap
+        
+    Return:
+        newstate: Array of coefficients after taking the timestep
+    '''
+    
+    #Diagonal and off-diagonal of H, see the H function
+    diag = 0.5*n_arr*(n_arr-1.0)-mu*n_arr+t*psi*psi
+    offdiag = -t*psi*sqr_arr[1:]
+    
+    E, V = scipy.linalg.eigh_tridiagonal(diag,offdiag,check_finite=False)
+    
+    #Degenerate ground states (psi = 0 at integer mu) are not damped apart
+    tau = tau_gap/max(E[1]-E[0],1e-12)
+    
+    #Propagate in the eigenbasis, relative to the ground state energy
+    y5 = V @ (np.exp(-tau*(E-E[0]))*(V.T @ y))
     
-    #Result must be re-normalized!
     return y5/np.linalg.norm(y5)
 
 
+#Time steppers for find_gnd, with the number of applications of H and of
+#diagonalizations of H per step
+STEPPERS = {'rk5': (RK5step, 6, 0), 'exp': (expstep, 0, 1)}
+
 
-def find_gnd(t,mu,tol = 1e-6,max_it=300000):
+def find_gnd(t,mu,tol = 1e-6,max_it=300000,y0=None,method = 'rk5',
+             return_stats = False,atol = 1e-7):
     '''
     Compute the ground state using imaginary time propagation by iterating 
-    the RK5 step function.
+    a step function, updating psi between steps.
     
     Args:
         t: Hopping amplitude
         mu: Chemical potential
-        tol: Tolerance for convergence
+        tol: Tolerance for convergence, on the change of psi per step (for
+             'rkf45' scaled by h/0.07, relative to a default RK5 step)
         max_it: Maximum number of iterations before breaking from loop.
+        y0: Initial state, defaults to a uniform superposition
+        method: 'rk5' for fixed RK5 steps (RK5step), 'rkf45' for RK5 steps
+                with adaptive size (RKF45Stepper), or 'exp' for exact
+                steps adapted to the spectral gap (expstep)
+        return_stats: If True, also return a dictionary with the number of
+                      steps, of applications of H and of diagonalizations
+                      of H, and for 'rkf45' the accepted and rejected steps
+                      and the final step size
+        atol: Error tolerance per step for 'rkf45'
         
     Return:
         groundstate: Ground state for the given parameters
+        psi: Superfluid order parameter
+        stats: Step statistics (if return_stats)
     '''
+    
+    if method == 'rkf45':
+        step, n_H, n_diag = RKF45Stepper(atol=atol), None, 0
+        steptol = lambda: tol*step.h_used/.07
+    elif method in STEPPERS:
+        step, n_H, n_diag = STEPPERS[method]
+        steptol = lambda: tol
+    else:
+        raise ValueError('Unknown method '+str(method))
 
     #Initial guess is a uniform superposition
-    y0 = np.ones(N+1)/np.sqrt(N+1)
+    if y0 is None:
+        y0 = np.ones(N+1)/np.sqrt(N+1)
     psi0 = compute_psi(y0)
     
     #Take one timestep and recalculate psi
-    y = RK5step(y0,psi0,t,mu)
+    y = step(y0,psi0,t,mu)
     psi = compute_psi(y)
     
     #Initialize counter
     cnt = 1
 
     #Iterate until psi and psi0 are within tolerance
-    while np.abs(psi-psi0) > tol:
+    while np.abs(psi-psi0) > steptol():
        
         #Update counter
         cnt += 1
@@ -158,7 +314,7 @@ def find_gnd(t,mu,tol = 1e-6,max_it=300000):
         psi0 = compute_psi(y0)
         
         #State after timestep
-        y = RK5step(y0,psi0,t,mu)
+        y = step(y0,psi0,t,mu)
         psi = compute_psi(y)
         
         #Break from loop if max number of iterations is reached
@@ -166,11 +322,16 @@ def find_gnd(t,mu,tol = 1e-6,max_it=300000):
             print('Did not converge after '+str(max_it)+' iterations')
             break
         
+    if return_stats:
+        if n_H is None:
+            return y, psi, dict(step.stats(), steps=cnt, diagonalizations=0)
+        return y, psi, {'steps': cnt, 'H_evals': n_H*cnt,
+                        'diagonalizations': n_diag*cnt}
 
     return y, psi 
 
 
-def find_psi(t,mu):
+def find_psi(t,mu,tol = 1e-6,method = 'rk5'):
     '''
     Find the value of the superfluid order parameter using imaginary
     time propagation.
@@ -178,34 +339,61 @@ def find_psi(t,mu):
     Args:
         t: Hopping amplitude
         mu: Chemical potential
+        tol: Tolerance for convergence
+        method: Time stepper, see find_gnd
         
     Return:
         psi: Superfluid order parameter
     '''
     
-    state, psi = find_gnd(t,mu)
+    state, psi = find_gnd(t,mu,tol,method=method)
     
     return psi
 
 
+def sweep(tlist,mu,tol = 1e-6,max_it = 300000,method = 'rk5'):
+    '''
+    Compute the order parameter along a list of t at fixed mu, starting the
+    propagation at each point from the ground state of the previous one
+    (see bdsearch.sweep).
+    
+    Args:
+        tlist: List of hopping amplitudes, in the order of the sweep
+        mu: Chemical potential
+        tol: Tolerance for convergence
+        max_it: Maximum number of iterations per point
+        method: Time stepper, see find_gnd
+        
+    Return:
+        psi: Array of order parameters
+    '''
+    
+    solve = lambda t,mu,start: find_gnd(t,mu,tol,max_it,y0=start,
+                                        method=method)
+    
+    return bdsearch.sweep(tlist,mu,solve,N)
+
+
 #List of hopping amplitudes to iterate over
 tlist = np.linspace(0.001,0.2,999)
 
-def bd(mu):
+def bd(mu,method = 'bisect'):
     '''
     Search for the phase boundary for a given mu, by iterating throught
     hopping amplitudes.
     
     Args:
         mu: Chemical potential
+        method: 'bisect' to bisect tlist with find_psi, or 'stability' to
+                solve for the instability of the insulator directly (see
+                bdsearch.bd_stability), which is not limited to tlist
         
     Return:
         bd_point: Critical hopping amplitude
         
     '''
     
-    
-    return bdsearch.bd(mu,tlist,find_psi)
+    return bdsearch.find_bd(mu,method,tlist,find_psi,N)
 
 
 
@@ -236,6 +424,60 @@ class TestImagtime(unittest.TestCase):
         
         self.assertTrue(np.abs(psi) < tol) 
     
+    def test_exponential(self):
+        '''
+        Test that exact exponential steps reach the same order parameter as
+        RK5 steps in far fewer steps, each a single diagonalization instead
+        of applications of the Hamiltonian.
+        '''
+        
+        for t, mu in [(0.05,0.5),(0.2,0.5),(0.3,2.2)]:
+            
+            y, psi, rk5 = find_gnd(t,mu,return_stats=True)
+            y, psi_exp, exp = find_gnd(t,mu,method='exp',return_stats=True)
+            
+            self.assertTrue(np.abs(psi - psi_exp) < 1e-4)
+            self.assertTrue(10*exp['steps'] < rk5['steps'])
+            self.assertEqual(exp['H_evals'], 0)
+            self.assertEqual(exp['diagonalizations'], exp['steps'])
+            self.assertEqual(rk5['diagonalizations'], 0)
+    
+    def test_adaptive(self):
+        '''
+        Test that adaptive RKF45 steps reach the order parameter at least as
+        accurately as fixed RK5 steps, with fewer applications of the
+        Hamiltonian.
+        '''
+        
+        for t, mu in [(0.05,0.5),(0.2,0.5),(0.3,2.2),(0.05,1.5)]:
+            
+            exact = find_gnd(t,mu,tol=1e-12,method='exp')[1]
+            y, psi, rk5 = find_gnd(t,mu,return_stats=True)
+            y, psi_rkf, rkf = find_gnd(t,mu,method='rkf45',return_stats=True)
+            
+            self.assertTrue(np.abs(psi_rkf - exact) <= np.abs(psi - exact))
+            self.assertTrue(rkf['H_evals'] < rk5['H_evals'])
+            self.assertEqual(rkf['steps'], rkf['accepted'])
+            self.assertTrue(rkf['rejected'] < rkf['accepted'])
+        
+        #Error estimate does not alter the step being propagated
+        y = np.ones(N+1)/np.sqrt(N+1)
+        for h in (0.07,0.1):
+            self.assertTrue(np.allclose(RKF45step(y,0.3,0.1,0.5,h)[0],
+                                        RK5step(y,0.3,0.1,0.5,h),0,1e-15))
+    
+    def test_sweep(self):
+        '''
+        Test that a warm-started sweep across the boundary at mu=0.5
+        reproduces independent solves, in both directions.
+        '''
+        
+        ts = np.linspace(0.1,0.3,5)
+        cold = np.array([find_psi(t,0.5) for t in ts])
+        
+        self.assertTrue(np.all(np.abs(sweep(ts,0.5) - cold) < 1e-3))
+        self.assertTrue(np.all(np.abs(sweep(ts[::-1],0.5) - cold[::-1]) < 1e-3))
+    
 
 #Run tests if in main namespace
 if __name__ == '__main__':
@@ -0,0 +1,232 @@
+"""
+phasediagram.py
+@author: Alex Hickey
+
+This module computes the phase boundary of the Bose-Hubbard model over a list
+of chemical potentials with one of the solver modules (exact_diag, imag_time
+or variational). The points are handed to a pool of worker processes one at a
+time, so that a few slow values of mu do not hold up the others, and each
+boundary point is returned as soon as it is found. Finished points can be
+appended to a checkpoint log, from which an interrupted run resumes. Each
+record of the log is a line 'mu t_c ;', and only records that end with the
+terminator are read back.
+"""
+
+#Import modules
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#Solver modules that can be passed by name
+METHODS = ('exact_diag', 'imag_time', 'variational')
+
+
+def get_module(method):
+    '''
+    Look up a solver module.
+
+    Args:
+        method: Solver module or its name, see METHODS
+
+    Return:
+        module: Solver module
+    '''
+
+    if isinstance(method, str):
+        if method not in METHODS:
+            raise ValueError('Unknown method {}, expected one of {}'
+                             .format(method, METHODS))
+        return importlib.import_module(method)
+
+    return method
+
+
+def read_checkpoint(checkpoint, header):
+    '''
+    Read the boundary points in a checkpoint log.
+
+    Args:
+        checkpoint: Path of the log
+        header: Expected first line, which records the solver
+
+    Return:
+        done: Dictionary mapping mu to the critical hopping amplitude
+    '''
+
+    done = {}
+
+    if not os.path.exists(checkpoint):
+        return done
+
+    with open(checkpoint) as f:
+
+        first = f.readline().rstrip('\n')
+        if first and first != header:
+            raise ValueError('Checkpoint {} was written by "{}", not "{}"'
+                             .format(checkpoint, first, header))
+
+        for line in f:
+            #The last line may be incomplete if the run was killed, and is
+            #only accepted if it reached the terminator
+            fields = line.split()
+            if len(fields) != 3 or fields[2] != ';':
+                continue
+            try:
+                done[float(fields[0])] = float(fields[1])
+            except ValueError:
+                continue
+
+    return done
+
+
+def phase_diagram(method, mulist, workers = None, checkpoint = None,
+                  bd_method = 'bisect'):
+    '''
+    Compute the phase boundary for a list of mu, yielding the points in the
+    order they complete.
+
+    Args:
+        method: Solver module or its name, see METHODS
+        mulist: List of chemical potentials
+        workers: Number of worker processes, defaults to the number of CPUs.
+                 With workers = 1 the points are computed in this process
+        checkpoint: Path of a log to append finished points to. Points
+                    already in the log are yielded first and not recomputed
+        bd_method: Search method passed to the bd function of the module
+
+    Return:
+        Generator of (mu, t_c) tuples
+    '''
+
+    module = get_module(method)
+    header = '# {} {} N={}'.format(module.__name__, bd_method, module.N)
+
+    done = read_checkpoint(checkpoint, header) if checkpoint else {}
+    todo = []
+
+    for mu in mulist:
+        mu = float(mu)
+        if mu in done:
+            yield mu, done[mu]
+        elif mu not in todo:
+            todo.append(mu)
+
+    if not todo:
+        return
+
+    log = None
+    if checkpoint:
+        size = os.path.getsize(checkpoint) if os.path.exists(checkpoint) else 0
+        log = open(checkpoint, 'a+')
+        if size == 0:
+            log.write(header + '\n')
+        else:
+            #Terminate a line cut off by an interrupted run
+            log.seek(size - 1)
+            if log.read(1) != '\n':
+                log.write('\n')
+
+    def record(mu, tc):
+        #Write each point as soon as it is known, so nothing is lost on a kill
+        if log is not None:
+            log.write('{!r} {!r} ;\n'.format(mu, float(tc)))
+            log.flush()
+            os.fsync(log.fileno())
+        return mu, tc
+
+    try:
+        if workers == 1:
+            for mu in todo:
+                yield record(mu, module.bd(mu, bd_method))
+            return
+
+        with ProcessPoolExecutor(workers) as pool:
+
+            futures = {pool.submit(module.bd, mu, bd_method): mu
+                       for mu in todo}
+
+            try:
+                for fut in as_completed(futures):
+                    yield record(futures[fut], fut.result())
+            finally:
+                #Drop queued points if the caller stops early
+                for fut in futures:
+                    fut.cancel()
+
+    finally:
+        if log is not None:
+            log.close()
+
+
+###############################################################################
+#Testing framework
+
+import unittest
+import tempfile
+
+class TestPhaseDiagram(unittest.TestCase):
+    '''
+    Unit testing class for functions in the phasediagram.py module
+    '''
+
+    def test_pool(self):
+        '''
+        Test that the pool returns the same boundary as computing every
+        point directly.
+        '''
+        import exact_diag
+
+        mulist = [0.2, 0.5, 0.9, 1.4, 2.5]
+        result = dict(phase_diagram('exact_diag', mulist, workers=2,
+                                    bd_method='stability'))
+
+        self.assertEqual(result, {mu: exact_diag.bd(mu, 'stability')
+                                  for mu in mulist})
+
+    def test_resume(self):
+        '''
+        Test that a run resumes from its checkpoint, including one that was
+        cut off in the middle of a line.
+        '''
+        import exact_diag
+
+        mulist = [0.2, 0.5, 0.9]
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            path = os.path.join(tmp, 'bd.log')
+
+            #Stop after the first point
+            run = phase_diagram('exact_diag', mulist, workers=1,
+                                checkpoint=path, bd_method='stability')
+            mu0, tc0 = next(run)
+            run.close()
+
+            #Fake value for the first point shows it is not recomputed
+            with open(path) as f:
+                lines = f.read().splitlines()
+            with open(path, 'w') as f:
+                f.write('\n'.join([lines[0], '{!r} -1.0 ;'.format(mu0),
+                                    '0.5 0.03']))
+
+            result = list(phase_diagram('exact_diag', mulist, workers=1,
+                                        checkpoint=path,
+                                        bd_method='stability'))
+
+            self.assertEqual(result[0], (mu0, -1.0))
+            self.assertEqual(sorted(mu for mu, _ in result), mulist)
+
+            #Line cut off inside t_c is recomputed, not read back
+            self.assertEqual(dict(result)[0.5], exact_diag.bd(0.5, 'stability'))
+
+            #Log now holds every point
+            self.assertEqual(set(read_checkpoint(path, lines[0])), set(mulist))
+
+            #Different solver refuses the log
+            with self.assertRaises(ValueError):
+                list(phase_diagram('variational', mulist, checkpoint=path))
+
+
+#Run tests if in main namespace
+if __name__ == '__main__':
+    unittest.main(argv=[''],verbosity=2,exit=False)
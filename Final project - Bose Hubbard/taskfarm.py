@@ -0,0 +1,484 @@
+"""
+taskfarm.py
+@author: Alex Hickey
+
+This module spreads the computation of the phase boundary over several
+machines. A coordinator serves a queue of (method, mu) tasks over TCP with
+multiprocessing.managers, and workers on any machine that can reach it fetch
+tasks, compute bd(mu) with the solver module named by method, and return the
+results. Workers send heartbeats while they compute, and the tasks of a
+worker that has not been heard from within the timeout are handed out again.
+
+Managers unpickle whatever they receive, so anyone who can connect with the
+authentication key can run code on the coordinator. The coordinator listens
+on localhost unless another host is chosen, and there is no default key: it
+is taken from the BH_AUTHKEY environment variable or generated and printed
+by the coordinator. Start the coordinator and the workers from the command
+line, e.g.
+
+    python taskfarm.py coordinator --method imag_time --host 0.0.0.0
+    BH_AUTHKEY=<key> python taskfarm.py worker coordinator-host:50000
+
+or from python with coordinate and worker.
+"""
+
+#Import modules
+import argparse
+import collections
+import os
+import secrets
+import socket
+import sys
+import threading
+import time
+from multiprocessing.managers import BaseManager
+import numpy as np
+import phasediagram
+
+#Seconds without a heartbeat after which a worker is presumed dead
+TIMEOUT = 30.0
+
+#Seconds between heartbeats of a worker
+HEARTBEAT = 5.0
+
+
+class Coordinator:
+    '''
+    Queue of tasks shared with the workers, which lives in the server process
+    of a FarmManager.
+    '''
+
+    def __init__(self, timeout = TIMEOUT):
+
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.pending = collections.deque()
+        self.running = {}
+        self.seen = {}
+        self.results = {}
+        self.requeued = 0
+
+    def submit(self, tasks):
+        '''
+        Add tasks to the queue.
+
+        Args:
+            tasks: List of (method, mu, bd_method) tuples
+
+        Return:
+            ids: List of task ids
+        '''
+
+        with self.lock:
+            ids = []
+            for task in tasks:
+                tid = len(self.tasks)
+                self.tasks[tid] = tuple(task)
+                self.pending.append(tid)
+                ids.append(tid)
+            return ids
+
+    def _requeue(self):
+        '''
+        Put the running tasks of workers that missed their heartbeats back in
+        the queue. Called with the lock held.
+        '''
+
+        now = time.monotonic()
+
+        for tid, worker in list(self.running.items()):
+            if now - self.seen.get(worker, 0) > self.timeout:
+                del self.running[tid]
+                self.pending.appendleft(tid)
+                self.requeued += 1
+
+    def get_task(self, worker):
+        '''
+        Hand out a task.
+
+        Args:
+            worker: Name of the worker
+
+        Return:
+            task: (task id, method, mu, bd_method), 'wait' if all remaining
+                  tasks are running, or None once every task is finished
+        '''
+
+        with self.lock:
+
+            self.seen[worker] = time.monotonic()
+            self._requeue()
+
+            while self.pending:
+                tid = self.pending.popleft()
+                if tid not in self.results:
+                    self.running[tid] = worker
+                    return (tid,) + self.tasks[tid]
+
+            return 'wait' if self.running else None
+
+    def heartbeat(self, worker):
+        '''
+        Record that a worker is alive.
+
+        Args:
+            worker: Name of the worker
+        '''
+
+        with self.lock:
+            self.seen[worker] = time.monotonic()
+
+    def put_result(self, worker, tid, value):
+        '''
+        Return the result of a task. A task that was handed out twice keeps
+        the first result.
+
+        Args:
+            worker: Name of the worker
+            tid: Task id
+            value: Result of the task
+        '''
+
+        with self.lock:
+            self.seen[worker] = time.monotonic()
+            self.running.pop(tid, None)
+            self.results.setdefault(tid, value)
+
+    def get_results(self, ids):
+        '''
+        Collect finished tasks.
+
+        Args:
+            ids: Task ids to look for
+
+        Return:
+            results: Dictionary mapping the finished task ids to the results
+        '''
+
+        with self.lock:
+            self._requeue()
+            return {tid: self.results[tid] for tid in ids
+                    if tid in self.results}
+
+    def status(self):
+        '''
+        Return:
+            status: Dictionary of task counts
+        '''
+
+        with self.lock:
+            return {'tasks': len(self.tasks), 'pending': len(self.pending),
+                    'running': len(self.running),
+                    'finished': len(self.results),
+                    'requeued': self.requeued}
+
+
+#The server process holds a single coordinator
+_coordinator = None
+
+def _get_coordinator(timeout = TIMEOUT):
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = Coordinator(timeout)
+    return _coordinator
+
+
+class FarmManager(BaseManager):
+    '''
+    Manager serving the coordinator over TCP.
+    '''
+
+FarmManager.register('coordinator', callable=_get_coordinator)
+
+
+def coordinate(method, mulist, address = ('localhost', 0), authkey = None,
+               bd_method = 'bisect', timeout = TIMEOUT, poll = 0.5,
+               started = None):
+    '''
+    Serve bd tasks for a list of mu and yield the boundary points as workers
+    return them.
+
+    Args:
+        method: Name of the solver module, see phasediagram.METHODS
+        mulist: List of chemical potentials
+        address: (host, port) to listen on, port 0 picks a free port
+        authkey: Authentication key shared with the workers, a random key
+                 is generated if None
+        bd_method: Search method passed to the bd function of the module
+        timeout: Seconds without a heartbeat before a task is requeued
+        poll: Seconds between checks for results
+        started: Function called with the (host, port) the coordinator
+                 listens on and the authentication key, once it accepts
+                 connections
+
+    Return:
+        Generator of (mu, t_c) tuples
+    '''
+
+    if method not in phasediagram.METHODS:
+        raise ValueError('Unknown method {}, expected one of {}'
+                         .format(method, phasediagram.METHODS))
+
+    if authkey is None:
+        authkey = secrets.token_hex(16).encode()
+
+    manager = FarmManager(address, authkey)
+    manager.start()
+
+    try:
+        coord = manager.coordinator(timeout)
+        ids = coord.submit([(method, float(mu), bd_method) for mu in mulist])
+        mus = dict(zip(ids, map(float, mulist)))
+
+        if started is not None:
+            started(manager.address, authkey)
+
+        while mus:
+            for tid, value in coord.get_results(list(mus)).items():
+                yield mus.pop(tid), value
+            if mus:
+                time.sleep(poll)
+
+        #Let waiting workers learn that the work is done before stopping
+        time.sleep(2*poll)
+
+    finally:
+        manager.shutdown()
+
+
+def _heartbeat(coord, name, stop, interval):
+    '''
+    Send heartbeats until stop is set.
+    '''
+
+    while not stop.wait(interval):
+        try:
+            coord.heartbeat(name)
+        except (OSError, EOFError):
+            return
+
+
+def worker(address, authkey, heartbeat = HEARTBEAT, poll = 0.5,
+           name = None):
+    '''
+    Fetch and compute tasks from a coordinator until all are finished.
+
+    Args:
+        address: (host, port) of the coordinator
+        authkey: Authentication key shared with the coordinator
+        heartbeat: Seconds between heartbeats, well below the timeout of
+                   the coordinator
+        poll: Seconds to wait when all remaining tasks are running elsewhere
+        name: Name of the worker, defaults to host:pid
+
+    Return:
+        count: Number of tasks computed
+    '''
+
+    name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    manager = FarmManager(tuple(address), authkey)
+    manager.connect()
+    coord = manager.coordinator()
+
+    count = 0
+
+    while True:
+
+        try:
+            task = coord.get_task(name)
+        except (OSError, EOFError):
+            #Coordinator has shut down
+            break
+
+        if task is None:
+            break
+        if task == 'wait':
+            time.sleep(poll)
+            continue
+
+        tid, method, mu, bd_method = task
+        module = phasediagram.get_module(method)
+
+        #Heartbeats go through a separate connection, since proxies are not
+        #shared between threads
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat,
+                                args=(manager.coordinator(), name, stop,
+                                      heartbeat),
+                                daemon=True)
+        beat.start()
+
+        try:
+            value = module.bd(mu, bd_method)
+        finally:
+            stop.set()
+            beat.join()
+
+        try:
+            coord.put_result(name, tid, float(value))
+        except (OSError, EOFError):
+            break
+        count += 1
+
+    return count
+
+
+def _announce(address, authkey):
+    '''
+    Print how to connect workers to a coordinator.
+    '''
+
+    print('Listening on {}:{}'.format(*address))
+    print('Start workers with BH_AUTHKEY={}'.format(authkey.decode()))
+    sys.stdout.flush()
+
+
+def main(argv = None):
+    '''
+    Command line interface, run with --help for options.
+    '''
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    sub = parser.add_subparsers(dest='role', required=True)
+
+    c = sub.add_parser('coordinator')
+    c.add_argument('--method', choices=phasediagram.METHODS, required=True)
+    c.add_argument('--bd-method', default='bisect')
+    c.add_argument('--mu', type=float, nargs=3, default=(0.001, 3.0, 250),
+                   metavar=('START', 'STOP', 'NUM'))
+    c.add_argument('--host', default='localhost',
+                   help='Interface to listen on, e.g. 0.0.0.0 for all')
+    c.add_argument('--port', type=int, default=50000)
+    c.add_argument('--timeout', type=float, default=TIMEOUT)
+    c.add_argument('--out', default='bd.txt')
+
+    w = sub.add_parser('worker')
+    w.add_argument('address', help='host:port of the coordinator')
+    w.add_argument('--heartbeat', type=float, default=HEARTBEAT)
+
+    args = parser.parse_args(argv)
+
+    authkey = os.environ.get('BH_AUTHKEY')
+    if authkey is not None:
+        authkey = authkey.encode()
+
+    if args.role == 'worker':
+        if authkey is None:
+            parser.error('set BH_AUTHKEY to the key printed by the coordinator')
+        host, port = args.address.rsplit(':', 1)
+        worker((host, int(port)), authkey, args.heartbeat)
+        return 0
+
+    start, stop, num = args.mu
+    mulist = np.linspace(start, stop, int(num))
+
+    with open(args.out, 'w') as f:
+        for mu, tc in coordinate(args.method, mulist, (args.host, args.port),
+                                 authkey, args.bd_method, args.timeout,
+                                 started=_announce):
+            print(mu, tc)
+            f.write('{!r} {!r}\n'.format(mu, tc))
+            f.flush()
+
+    return 0
+
+
+###############################################################################
+#Testing framework
+
+import unittest
+import multiprocessing
+
+def _dead_worker(address, authkey):
+    '''
+    Take a task and exit without returning it, as a crashed worker would.
+    '''
+    manager = FarmManager(tuple(address), authkey)
+    manager.connect()
+    manager.coordinator().get_task('dead')
+
+class TestTaskFarm(unittest.TestCase):
+    '''
+    Unit testing class for functions in the taskfarm.py module
+    '''
+
+    def test_localhost(self):
+        '''
+        Test that workers on localhost compute every point, and that the
+        task of a dead worker is handed out again.
+        '''
+        import exact_diag
+
+        mulist = [0.2, 0.5, 0.9, 1.4, 2.5, 2.9]
+        queue = multiprocessing.Queue()
+
+        #Run the coordinator in a thread, so that it can be told the port
+        results = {}
+        def run():
+            for mu, tc in coordinate('exact_diag', mulist,
+                                     ('localhost', 0), bd_method='stability',
+                                     timeout=0.5, poll=0.05,
+                                     started=lambda *a: queue.put(a)):
+                results[mu] = tc
+
+        coord = threading.Thread(target=run)
+        coord.start()
+        address, authkey = queue.get(timeout=10)
+
+        #Dead worker grabs the first task before the live ones start
+        dead = multiprocessing.Process(target=_dead_worker,
+                                       args=(address, authkey))
+        dead.start()
+        dead.join()
+
+        procs = [multiprocessing.Process(target=worker,
+                                         args=(address, authkey, 0.1, 0.05))
+                 for _ in range(3)]
+        for p in procs:
+            p.start()
+
+        coord.join(60)
+        for p in procs:
+            p.join(10)
+
+        self.assertFalse(coord.is_alive())
+        self.assertEqual(results, {mu: exact_diag.bd(mu, 'stability')
+                                   for mu in mulist})
+        self.assertTrue(all(p.exitcode == 0 for p in procs))
+
+    def test_authkey(self):
+        '''
+        Test that the coordinator generates a key, listens on localhost by
+        default, and turns away workers with the wrong key.
+        '''
+
+        queue = multiprocessing.Queue()
+        run = coordinate('exact_diag', [0.5], bd_method='stability',
+                         poll=0.05, started=lambda *a: queue.put(a))
+
+        #Start the coordinator by asking for its first result
+        first = threading.Thread(target=next, args=(run,))
+        first.start()
+        address, authkey = queue.get(timeout=10)
+
+        self.assertEqual(address[0], '127.0.0.1')
+        self.assertEqual(len(authkey), 32)
+
+        with self.assertRaises(multiprocessing.AuthenticationError):
+            FarmManager(tuple(address), b'wrong').connect()
+
+        worker(address, authkey, 0.1, 0.05)
+        first.join(10)
+        run.close()
+
+
+#Run tests if in main namespace, or start a coordinator or worker from the
+#command line
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        sys.exit(main())
+
+    unittest.main(argv=[''],verbosity=2,exit=False)
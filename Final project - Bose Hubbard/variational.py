@@ -68,7 +68,7 @@ def expH(state,t,mu):
 
 
 
-def ground(t,mu,tol = 1e-13):
+def ground(t,mu,tol = 1e-13,y0 = None):
     '''
     Calculate order parameter which minimizes the free energy using the
     scipy.optimize.minimize function.
@@ -77,6 +77,7 @@ def ground(t,mu,tol = 1e-13):
         t: Hopping amplitude
         mu: Chemical potential
         tol: Tolerance for convergence
+        y0: Initial state, defaults to a uniform superposition
         
     Return:
         state: State that minimizes <H>
@@ -84,7 +85,8 @@ def ground(t,mu,tol = 1e-13):
     '''
     
     #Initial guess is uniform superposition
-    y0 = np.ones(N+1)/np.sqrt(N+1)
+    if y0 is None:
+        y0 = np.ones(N+1)/np.sqrt(N+1)
     
     #Minimize <H>
     res = scipy.optimize.minimize(expH,y0,args = (t,mu),tol=tol)
@@ -112,24 +114,48 @@ def find_psi(t,mu,tol = 1e-13):
     return compute_psi(groundstate)
 
 
+def sweep(tlist,mu,tol = 1e-13):
+    '''
+    Compute the order parameter along a list of t at fixed mu, starting the
+    minimization at each point from the minimizer of the previous one (see
+    bdsearch.sweep).
+    
+    Args:
+        tlist: List of hopping amplitudes, in the order of the sweep
+        mu: Chemical potential
+        tol: Tolerance for convergence
+        
+    Return:
+        psi: Array of order parameters
+    '''
+    
+    def solve(t,mu,start):
+        state = ground(t,mu,tol=tol,y0=start)
+        return state, compute_psi(state)
+    
+    return bdsearch.sweep(tlist,mu,solve,N)
+
+
 #List of hopping amplitudes to iterate over
 tlist = np.linspace(0.001,0.2,999)
 
-def bd(mu):
+def bd(mu,method = 'bisect'):
     '''
     Search for the phase boundary for a given mu, by iterating throught
     hopping amplitudes.
     
     Args:
         mu: Chemical potential
+        method: 'bisect' to bisect tlist with find_psi, or 'stability' to
+                solve for the instability of the insulator directly (see
+                bdsearch.bd_stability), which is not limited to tlist
         
     Return:
         bd_point: Critical hopping amplitude
         
     '''
     
-    
-    return bdsearch.bd(mu,tlist,find_psi)
+    return bdsearch.find_bd(mu,method,tlist,find_psi,N)
 
 ###############################################################################
 #Testing framework
@@ -158,6 +184,18 @@ class TestVariational(unittest.TestCase):
         
         self.assertTrue(np.abs(psi) < tol) 
     
+    def test_sweep(self):
+        '''
+        Test that a warm-started sweep across the boundary at mu=0.5
+        reproduces independent solves, in both directions.
+        '''
+        
+        ts = np.linspace(0.1,0.3,5)
+        cold = np.array([find_psi(t,0.5) for t in ts])
+        
+        self.assertTrue(np.all(np.abs(sweep(ts,0.5) - cold) < 1e-6))
+        self.assertTrue(np.all(np.abs(sweep(ts[::-1],0.5) - cold[::-1]) < 1e-6))
+    
 
 #Run tests if in main namespace
 if __name__ == '__main__':